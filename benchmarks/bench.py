@@ -0,0 +1,146 @@
+"""
+Time path search, scoring and planning over a fixed corpus of missions.
+
+For every case the phases are timed separately (the best of --repeat runs is kept):
+
+    search    best-first graph search for the case's routes (no route index)
+    lookup    find_best_paths, with the route index loaded
+    scoring   add_path_stats on the routes
+    encoding  building the z3 models of the best --routes routes
+    solving   z3 solving those models (without a bound)
+    plan      plan_routes with the default engine, as the CLI runs it
+
+The results are written as JSON. With --compare, every phase is checked against an earlier
+result file and the run fails (exit status 1) if a phase got slower than --threshold times the
+old time, plus --slack seconds to absorb noise in very short phases:
+
+    python benchmarks/bench.py --output base.json
+    python benchmarks/bench.py --compare base.json
+"""
+import argparse
+import datetime
+import platform
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from les import __version__, Planner, Locations, DEFAULT_GRAPH, find_best_paths, add_path_stats, route_index
+from les.solve import plan_routes
+
+CORPUS = (
+    ("moon", "E", "L", 1, {}),
+    ("moon-no-rendezvous", "E", "L", 3, {"rendezvous": False}),
+    ("mars", "E", "M", 2, {}),
+    ("mars-aerobraking", "E", "M", 2, {"aerobraking": True}),
+    ("mars-year", "E", "M", 1, {"year": 1965}),
+    ("titan-year", "E", "T", 1, {"year": 1960}),
+    ("titan-free-ions", "E", "T", 1, {"year": 1960, "free_ions": 2}),
+    ("enceladus-aerobraking", "E", "D", 1, {"year": 1958, "aerobraking": True}),
+    ("neptune-flyby-year", "E", "Nfb", 1, {"year": 1962}),
+    ("neptune-flyby-time", "E", "Nfb", 1, {"year": 1956, "time": (0, 12)}),
+)
+
+PHASES = ("search", "lookup", "scoring", "encoding", "solving", "plan")
+
+def _timed(f):
+    start = time.perf_counter()
+    result = f()
+    return time.perf_counter() - start, result
+
+def run_case(orig, dest, payload, options, minimize, routes):
+    src, dst = Locations[orig], Locations[dest]
+    aerobraking = options.get("aerobraking", False)
+    index = route_index()
+    timings = {}
+
+    timings["search"], _ = _timed(lambda: index.search(DEFAULT_GRAPH.node_ids[src], DEFAULT_GRAPH.node_ids[dst], aerobraking))
+    timings["lookup"], paths = _timed(lambda: find_best_paths(src, dst, aerobraking=aerobraking))
+    timings["scoring"], _ = _timed(lambda: list(add_path_stats(paths, aerobraking)))
+
+    planner = Planner(load=payload, engine="z3", **options)
+    timings["encoding"] = timings["solving"] = 0
+    errors = 0
+    for path in paths[:routes]:
+        try:
+            elapsed, (solver, _) = _timed(lambda: planner._encode(list(reversed(path)), minimize))
+        except Exception:
+            errors += 1
+            continue
+        timings["encoding"] += elapsed
+        elapsed, _ = _timed(lambda: planner._check(solver))
+        timings["solving"] += elapsed
+
+    planner = Planner(load=payload, **options)
+    found = []
+    timings["plan"], mission = _timed(lambda: plan_routes(planner, paths, minimize, errors=found))
+    return timings, {"routes": len(paths), "errors": errors, minimize: mission[minimize] if mission else None}
+
+def compare(results, baseline, threshold, slack):
+    failed = []
+    for name, case in results["cases"].items():
+        old = baseline["cases"].get(name)
+        if old is None:
+            continue
+        for phase in PHASES:
+            if phase in old["timings"] and case["timings"][phase] > old["timings"][phase] * threshold + slack:
+                failed.append("{} {}: {:.4f}s (was {:.4f}s)".format(name, phase, case["timings"][phase], old["timings"][phase]))
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark les over a fixed mission corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per case (the fastest is kept)")
+    parser.add_argument("--minimize", choices=("cost", "mass", "time"), default="cost")
+    parser.add_argument("--routes", type=int, default=1, help="Number of routes per case that encoding and solving are timed on")
+    parser.add_argument("--cases", nargs="*", help="Only run these cases")
+    parser.add_argument("--output", help="Write the results to this file")
+    parser.add_argument("--compare", help="Compare with the results in this file")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Largest allowed slow-down factor of a phase")
+    parser.add_argument("--slack", type=float, default=0.005, help="Allowed slow-down in seconds on top of the factor")
+    args = parser.parse_args()
+
+    # load the route index and z3 before anything is timed
+    if not route_index().built():
+        route_index().build()
+    import z3
+    results = {
+        "meta": {
+            "les": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "minimize": args.minimize,
+            "repeat": args.repeat,
+            "routes": args.routes,
+        },
+        "cases": {},
+    }
+    for name, orig, dest, payload, options in CORPUS:
+        if args.cases and name not in args.cases:
+            continue
+        best = None
+        for _ in range(args.repeat):
+            timings, outcome = run_case(orig, dest, payload, options, args.minimize, args.routes)
+            best = timings if best is None else {phase: min(best[phase], timings[phase]) for phase in PHASES}
+        results["cases"][name] = {"timings": best, "outcome": outcome}
+        print("{:<22} {}".format(name, "  ".join("{} {:.4f}".format(phase, best[phase]) for phase in PHASES)), file=sys.stderr)
+
+    text = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            failed = compare(results, json.load(f), args.threshold, args.slack)
+        for line in failed:
+            print("Slower: {}".format(line), file=sys.stderr)
+        if failed:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
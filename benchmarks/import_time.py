@@ -0,0 +1,57 @@
+"""
+Check the cold start of the les package and CLI.
+
+Every command is run in a fresh interpreter a few times and the fastest run is compared with its
+budget (in milliseconds). The commands must also finish without importing z3. Exits with status 1
+if any budget is exceeded, so it can be run before committing:
+
+    python benchmarks/import_time.py [--runs N] [--scale X]
+"""
+import argparse
+import subprocess
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECK = """
+import sys, time
+start = time.perf_counter()
+{}
+elapsed = time.perf_counter() - start
+print(elapsed, "z3" in sys.modules)
+"""
+
+# name, statement, budget in ms
+COMMANDS = (
+    ("import les", "import les", 75),
+    ("import les.scripts.cli", "import les.scripts.cli", 110),
+    ("les --help", "from les.scripts.cli import cli\ntry:\n    cli(['--help'])\nexcept SystemExit:\n    pass", 120),
+    ("les E Xx", "from les.scripts.cli import cli\ntry:\n    cli(['E', 'Xx'])\nexcept SystemExit:\n    pass", 120),
+)
+
+def run(statement):
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    out = subprocess.run([sys.executable, "-c", CHECK.format(statement)], env=env, check=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+    elapsed, z3 = out.split()[-2:]
+    return float(elapsed) * 1000, z3 == "True"
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of les against a budget")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs per command")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget by this factor (for slow machines)")
+    args = parser.parse_args()
+
+    failed = False
+    for name, statement, budget in COMMANDS:
+        results = [run(statement) for _ in range(args.runs)]
+        best = min(elapsed for elapsed, _ in results)
+        z3 = any(z3 for _, z3 in results)
+        ok = best <= budget * args.scale and not z3
+        failed = failed or not ok
+        print("{:<24} {:8.1f} ms  budget {:6.1f} ms{}  {}".format(name, best, budget * args.scale, "  imports z3" if z3 else "", "ok" if ok else "FAIL"))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
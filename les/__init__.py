@@ -1,7 +1,8 @@
 from .__version__ import __version__
-from .les import Planner, DEFAULT_COMPONENT_MAX
-from .location import Locations, EEso, EEo, EsoEo
-from math import sqrt
+from .les import Planner, IncrementalPlanner, PrefixPlanner, DEFAULT_COMPONENT_MAX
+from .location import Locations, DEFAULT_GRAPH, EEso, EEo, EsoEo, load_map, parse_map
+from .index import RouteIndex
+from itertools import islice, takewhile
 
 def build_route(route):
     it = iter(route)
@@ -11,58 +12,94 @@ def build_route(route):
         yield src.to(dst)
         src = dst
 
-def add_path_stats(paths, aerobraking=False):
-    stats = []
-    for path in paths:
-        maneuvers = [m for m in path if m not in [EEso, EsoEo, EEo]]
-        maneuvers = path
-        diffs = [sqrt(i+10.0)*(m.get_diff(aerobraking))+m.get_time(aerobraking) for i, m in enumerate(maneuvers)]
-        stats.append(sum(diffs))
+def add_path_stats(paths, aerobraking=False, graph=DEFAULT_GRAPH):
+    paths = list(paths)
+    edge_ids = graph.edge_ids
+    stats = [graph.score([edge_ids[m] for m in path], aerobraking) for path in paths]
     return zip(stats, paths)
 
-def find_best_paths(src, dst, path_filter="optimal", single_stage=False, aerobraking=False):
-    paths = find_paths(src, dst)
-    if not paths:
-        return []
-    paths = add_path_stats(paths, aerobraking)
-    paths = sorted(paths, key=lambda i: i[0]) # sort by stdev/mean or whatever technique we used for stats
+_indexes = {} # by graph
+
+"""
+The all-pairs index of the routes that iter_paths yields first on the graph.
+"""
+def route_index(graph=DEFAULT_GRAPH):
+    if graph not in _indexes:
+        _indexes[graph] = RouteIndex(graph, skip=graph.skip)
+    return _indexes[graph]
+
+"""
+Whether the route index covers the routes that path_filter asks for on the graph.
+"""
+def _indexed(path_filter, graph):
+    if len(graph.maneuvers) > RouteIndex.MAX_MANEUVERS:
+        return False
+    return path_filter != "all" and not (path_filter.isdigit() and int(path_filter) > RouteIndex.RANKS)
+
+"""
+The routes to try from src to dst (locations of graph), best first.
+"""
+def find_best_paths(src, dst, path_filter="optimal", single_stage=False, aerobraking=False, graph=DEFAULT_GRAPH):
+    if not _indexed(path_filter, graph):
+        paths = iter_paths(src, dst, aerobraking, graph)
+    else:
+        paths = ((score, graph.route(edges)) for score, edges in
+                 route_index(graph).lookup(graph.node_ids[src], graph.node_ids[dst], aerobraking))
     if path_filter != "all":
         if path_filter.isdigit():
-            paths = paths[:int(path_filter)]
+            paths = islice(paths, int(path_filter))
         else: # optimal
-            threshold = paths[0][0] * 1.2 # allow slightly higher difficulty paths than the least difficult
-            paths = [p for p in paths if p[0] <= threshold]
-    #for p in paths:
-    #    if p[1][0] != EEo:
-    #        print(p)
+            best = next(paths, None)
+            if best is None:
+                return []
+            threshold = best[0] * 1.2 # allow slightly higher difficulty paths than the least difficult
+            paths = takewhile(lambda p: p[0] <= threshold, _chain(best, paths))
     paths = [p[1] for p in paths]
     if single_stage:
-        single_stage_paths = []
-        for p in paths:
-            if p[0] == EEso:
-                single_stage = p.copy()[2:]
-                single_stage.insert(0, EEo)
-                single_stage_paths.append(single_stage)
-        paths = paths + single_stage_paths
+        paths = _add_single_stage(paths, graph)
     return paths
 
-def find_paths(src, dst):
-    paths = []
-    for m in src.maneuvers:
-        if m == EEo: # don't use single-stage routes
-            continue
-        paths += _find_path(m, dst, [], [])
-    return paths
+def _add_single_stage(paths, graph=DEFAULT_GRAPH):
+    if not graph.single_stage:
+        return paths
+    direct, first, second = (graph.maneuvers[e] for e in graph.single_stage)
+    single_stage_paths = []
+    for p in paths:
+        if p[:2] == [first, second]:
+            single_stage = p.copy()[2:]
+            single_stage.insert(0, direct)
+            single_stage_paths.append(single_stage)
+    return paths + single_stage_paths
 
-def _find_path(mc, dst, path=[], visited=[]):
-    visited = visited + [mc.src]
-    path = path + [mc]
-    if mc.dst == dst:
-        return [path]
-    paths = []
-    for m in mc.dst.maneuvers:
-        if m not in path and m.dst not in visited:
-            newpaths = _find_path(m, dst, path, visited)
-            for newpath in newpaths:
-                paths.append(newpath)
-    return paths
+"""
+The paths that find_best_paths returns from src to each of dsts, as a dict. Route filters that
+the route index covers (and "optimal") are planned for each destination, and the others (e.g.
+"all") search for every destination at once, over one search tree.
+"""
+def find_campaign_paths(src, dsts, path_filter="optimal", single_stage=False, aerobraking=False, graph=DEFAULT_GRAPH):
+    if path_filter == "optimal" or _indexed(path_filter, graph):
+        return {dst: find_best_paths(src, dst, path_filter, single_stage, aerobraking, graph) for dst in dsts}
+    nodes = {graph.node_ids[dst]: dst for dst in dsts}
+    found = {node: [] for node in nodes}
+    limit = None if path_filter == "all" else int(path_filter)
+    wanted = set(nodes)
+    for node, _, edges in graph.search_many(graph.node_ids[src], wanted, aerobraking, graph.skip):
+        found[node].append(graph.route(edges))
+        if limit is not None and len(found[node]) >= limit:
+            wanted.discard(node)
+    return {nodes[node]: _add_single_stage(paths, graph) if single_stage else paths for node, paths in found.items()}
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+def find_paths(src, dst, graph=DEFAULT_GRAPH):
+    return [path for _, path in iter_paths(src, dst, graph=graph)]
+
+"""
+Yield (score, path) tuples for every simple path from src to dst, lazily and in the order of
+add_path_stats scores; ties keep the order of a depth-first search over the maneuver lists.
+"""
+def iter_paths(src, dst, aerobraking=False, graph=DEFAULT_GRAPH):
+    for score, edges in graph.search(graph.node_ids[src], graph.node_ids[dst], aerobraking, graph.skip):
+        yield score, graph.route(edges)
@@ -0,0 +1,143 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import asyncio
+import json
+import os
+from .solve import Session, Cancellation
+from .graph import Graph
+import logging
+log = logging.getLogger("les")
+
+_session = None
+_flags = None
+
+def _init_worker(flags, jobs, cache):
+    global _session, _flags
+    _session = Session(jobs=jobs, cache=cache)
+    _flags = flags
+
+"""
+Answer one query with the worker's Session. The query is cancelled as soon as its flag is set,
+which also interrupts z3 since only one query runs in a worker at a time.
+"""
+def _solve(slot, orig, dest, payload, options):
+    cancel = Cancellation()
+    done = threading.Event()
+    def watch():
+        while not done.wait(0.05):
+            if _flags[slot]:
+                cancel.cancel()
+                return
+    threading.Thread(target=watch, daemon=True).start()
+    try:
+        return _session.solve(orig, dest, payload, cancel=cancel, **options)
+    finally:
+        done.set()
+
+"""
+Maps in the options of a query are told apart by their keys.
+"""
+def _option(value):
+    if isinstance(value, Graph):
+        return value.key
+    raise TypeError("Can not compare queries on {!r}".format(value))
+
+class _Query():
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+"""
+An asyncio facade for planning missions without blocking the event loop.
+
+Queries are answered by Session.solve in a pool of worker processes (z3 can only solve one
+model per process at a time), each with its own Session, so settings, route searches and solvers
+are shared between the queries a worker answers. solve() takes the same arguments as
+Session.solve and returns the same mission (None if there is none), or raises the error that
+stopped the search if no mission was found.
+
+Identical queries that are in flight at the same time are only solved once. At most max_pending
+distinct queries are queued or solved at once; solve() waits for a free place before the query
+is handed to the pool, so callers are slowed down rather than the pool growing without limit.
+
+Cancelling solve() (e.g. by a timeout or a disconnected client) cancels its query once nobody
+else is waiting for it: a queued query is dropped and a running one is interrupted in its
+worker. Use it as an async context manager, or call close(), to stop the workers.
+"""
+class AsyncPlanner():
+    def __init__(self, workers=None, max_pending=64, jobs=1, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self._flags = multiprocessing.Array("b", max_pending, lock=False)
+        self._slots = list(range(max_pending))
+        self._executor = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self._flags, jobs, cache))
+        self._pending = asyncio.Semaphore(max_pending)
+        self._queries = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    """
+    The number of distinct queries that are queued, being solved or waiting for a place.
+    """
+    @property
+    def pending(self):
+        return len(self._queries)
+
+    async def solve(self, orig, dest, payload=1, **options):
+        key = json.dumps([orig, dest, payload, options], sort_keys=True, default=_option)
+        query = self._queries.get(key)
+        if query is None:
+            query = _Query(asyncio.ensure_future(self._run(key, orig, dest, payload, options)))
+            self._queries[key] = query
+        query.waiters += 1
+        try:
+            mission, errors = await asyncio.shield(query.task)
+        except asyncio.CancelledError:
+            if query.waiters == 1:
+                query.task.cancel()
+                # a new identical query must not wait for the cancelled one
+                if self._queries.get(key) is query:
+                    del self._queries[key]
+            raise
+        finally:
+            query.waiters -= 1
+        if mission is None and errors:
+            raise errors[0]
+        return mission
+
+    async def _run(self, key, orig, dest, payload, options):
+        try:
+            async with self._pending:
+                slot = self._slots.pop()
+                self._flags[slot] = 0
+                work = self._executor.submit(_solve, slot, orig, dest, payload, options)
+                future = asyncio.wrap_future(work)
+                try:
+                    return await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    log.info("Cancelling {} to {}".format(orig, dest))
+                    self._flags[slot] = 1
+                    work.cancel() # only succeeds if no worker has started it
+                    await asyncio.wait([future]) # the slot is free once the worker has stopped
+                    raise
+                finally:
+                    self._slots.append(slot)
+        finally:
+            query = self._queries.get(key)
+            if query is not None and query.task is asyncio.current_task():
+                del self._queries[key]
+
+    """
+    Cancel every query and stop the workers.
+    """
+    async def close(self):
+        tasks = [query.task for query in self._queries.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
@@ -0,0 +1,354 @@
+from .util import ION_THRUST, ION_WEIGHT, cost
+from collections import OrderedDict
+from math import inf
+from .frontier import ROCKETS, DEFAULT_CAPS, combinations, frontier_table
+from .calendar import route_calendar
+import logging
+log = logging.getLogger("les")
+
+"""
+An exact allocator of rockets, as an alternative to z3.
+
+The route is processed backwards (the same direction as Planner._plan): the rockets of a
+maneuver have to lift the payload plus the rockets of every later maneuver. For every number of
+ion thrusters, the states after each maneuver are the load, the cost of the rockets and the time
+spent so far. A state is dropped when another one is no worse in all three, since anything that
+can be flown from it can be flown from the other one at no greater cost, mass or time, and for
+each maneuver only the rocket combinations that are Pareto-optimal in mass and cost are tried;
+with the default component limits these come from the precomputed frontier table.
+
+With a starting year, the states also keep the year in which the mission arrives, which is set
+by the first slingshot (from the end) that the route reaches, and the time of the last maneuver.
+The year of every maneuver follows from the arrival year and the time spent after it, so a
+slingshot only keeps the states whose year is in the route's slingshot calendar, and states are
+only compared with states in the same year, on their load, cost, time and year of the last
+maneuver. Between slingshots, the mission may wait on any other timed maneuver. Ties are broken
+the same way as in z3: by the earliest year of the last maneuver and then the latest start.
+
+The limits on the total number of each rocket are left out of the states (only the per-maneuver
+limits are kept), so the best state may break them; allocate() then returns UNDECIDED and the
+caller has to use z3.
+"""
+
+UNDECIDED = "undecided"
+
+"""
+Check if the allocator can solve the (reversed) route with the planner's settings: there may be
+no lower limits on the number of rockets or the cost, nor on the time if there is a starting
+year.
+"""
+def applies(planner, route):
+    if planner.year and planner.time[0] > 0:
+        return False
+    if any(getattr(planner, rocket)[0] > 0 for rocket in ROCKETS):
+        return False
+    return not planner.cost or planner.cost[0] <= 0
+
+"""
+Return the order in which the totals (cost, load, time) are compared for a minimization target.
+"""
+def objective(minimize, t_cost, t_load, t_time):
+    if minimize == "time":
+        return (t_time, t_cost, t_load)
+    if minimize == "mass":
+        return (t_load, t_cost, t_time)
+    if minimize == "cost":
+        return (t_cost, t_time, t_load)
+    return ()
+
+def _combinations(diff, need, caps):
+    if caps == DEFAULT_CAPS:
+        return frontier_table().lookup(diff, need)
+    return combinations(diff, need, caps)
+
+def _prune(states):
+    kept = []
+    for key in sorted(states):
+        if not any(c <= key[1] and t <= key[2] for _, c, t in kept):
+            kept.append(key)
+    return {key: states[key] for key in kept}
+
+def _prune_years(states):
+    kept = []
+    groups = {}
+    for key in sorted(states, key=lambda k: k[:3]):
+        load, c, t, arrival, last = key
+        # what is left of the route only depends on the year of the maneuver, which is only
+        # known after a slingshot; before that, less time only moves the arrival forward
+        if arrival is None:
+            group, year = groups.setdefault(None, {}), t - (last or 0)
+        else:
+            group, year = groups.setdefault(arrival - t, {}), arrival - last
+        # the least cost of the states kept so far (which are no heavier) for each time and year
+        if not any(gt <= t and gy <= year and gc <= c for (gt, gy), gc in group.items()):
+            group[(t, year)] = c
+            kept.append(key)
+    return {key: states[key] for key in kept}
+
+"""
+A least recently used cache of the layers of states that _search finds, so that routes which end
+with the same maneuvers (e.g. everything from Sfb on) only search them once, within a query and
+across queries with the same settings. A layer is keyed by the settings it depends on, the number
+of ions and the maneuvers up to it, and holds at most max_states states in all.
+"""
+class SuffixCache():
+    def __init__(self, max_states=100000):
+        self.max_states = max_states
+        self.states = 0
+        self.hits = 0
+        self.misses = 0
+        self._layers = OrderedDict()
+
+    def get(self, key):
+        layer = self._layers.get(key)
+        if layer is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._layers.move_to_end(key)
+        return layer
+
+    def put(self, key, layer):
+        self._layers[key] = layer
+        self.states += len(layer) + 1
+        while self.states > self.max_states and len(self._layers) > 1:
+            _, old = self._layers.popitem(last=False)
+            self.states -= len(old) + 1
+
+    def clear(self):
+        self._layers.clear()
+        self.states = 0
+
+_suffixes = None
+
+"""
+The shared suffix cache of this process.
+"""
+def suffix_cache():
+    global _suffixes
+    if _suffixes is None:
+        _suffixes = SuffixCache()
+    return _suffixes
+
+def _rockets(history, key):
+    used = [0]*len(ROCKETS)
+    stages = []
+    for i in reversed(range(len(history))):
+        previous, counts, duration = history[i][key]
+        used = [u + c for u, c in zip(used, counts)]
+        stages.append((counts, duration))
+        key = previous
+    return used, list(reversed(stages))
+
+"""
+Return the best final states of the (reversed) route as (objective value, ion, history, state),
+best first, keeping to every limit except the totals of each rocket type.
+"""
+def _search(planner, route, detach, minimize=None, minimize_value=None, years=True):
+    if planner.year and years:
+        return _search_years(planner, route, detach, minimize, minimize_value)
+    caps = tuple(getattr(planner, rocket)[1] for rocket in ROCKETS)
+    diffs = [m.get_diff(planner.aerobraking) for m in route]
+    times = [m.get_time(planner.aerobraking) for m in route]
+    timed = [t is not False for t in times]
+    min_times = [t if t is not False else 0 for t in times]
+    # the least time that the maneuvers from i onwards need
+    remaining = [sum(min_times[i:]) for i in range(len(route) + 1)]
+    if remaining[0] > planner.time[1] or (planner.time[0] > 0 and not any(timed)):
+        return []
+
+    # the layers only depend on the maneuvers so far, not on the rest of the route
+    suffixes = suffix_cache()
+    settings = (planner.load, caps, planner.time[1], None)
+    # (untimed maneuvers are told apart from ones that take at least 0 years, since False == 0)
+    signature = tuple((d, timed[i], min_times[i], m in detach) for i, (d, m) in enumerate(zip(diffs, route)))
+
+    # missions report their mass without the payload
+    limit = minimize_value + planner.load if minimize == "mass" and minimize_value is not None else minimize_value
+    candidates = []
+    for ion in range(planner.ion[0], planner.ion[1] + 1):
+        ion_cost = cost(ion=ion, free_ions=planner.free_ions)
+        states = {(planner.load, 0, 0): None}
+        history = []
+        for i, maneuver in enumerate(route):
+            layer = suffixes.get((settings, ion, signature[:i+1]))
+            if layer is None:
+                ion_mass = 0 if maneuver in detach else ion*ION_WEIGHT
+                following = {}
+                for (load, rockets_cost, t_time) in states:
+                    need = diffs[i]*(load + ion_mass)
+                    durations = [min_times[i]]
+                    if timed[i] and ion:
+                        # more time only helps until the ions alone cover the maneuver
+                        longest = min(planner.time[1] - t_time, -(-need // (ion*ION_THRUST)))
+                        durations = range(min_times[i], max(longest, min_times[i]) + 1)
+                    for duration in durations:
+                        for m, c, counts in _combinations(diffs[i], need - ion*ION_THRUST*duration, caps):
+                            key = (load + m, rockets_cost + c, t_time + duration)
+                            if key not in following:
+                                following[key] = ((load, rockets_cost, t_time), counts, duration)
+                layer = _prune(following)
+                suffixes.put((settings, ion, signature[:i+1]), layer)
+            states = layer
+            history.append(states)
+            if not states:
+                break
+
+        for (load, rockets_cost, t_time) in states:
+            t_cost = rockets_cost + ion_cost
+            if planner.cost and t_cost > planner.cost[1] or t_time > planner.time[1]:
+                continue
+            # extra time on a timed maneuver never hurts
+            value = objective(minimize, t_cost, load, max(t_time, planner.time[0]))
+            if minimize_value is not None and value[0] > limit:
+                continue
+            candidates.append((value, ion, history, (load, rockets_cost, t_time)))
+    candidates.sort(key=lambda c: c[0])
+    return candidates
+
+"""
+The same as _search for a planner with a starting year (and no lower limit on the time). The
+states are (load, rockets cost, time, arrival year, time of the last maneuver).
+"""
+def _search_years(planner, route, detach, minimize=None, minimize_value=None):
+    calendar = route_calendar(planner, route)
+    if not calendar.schedules:
+        return []
+    caps = tuple(getattr(planner, rocket)[1] for rocket in ROCKETS)
+    diffs = [m.get_diff(planner.aerobraking) for m in route]
+    times = [m.get_time(planner.aerobraking) for m in route]
+    min_times = [t if t is not False else 0 for t in times]
+    # it makes no difference where the mission waits between two slingshots, so it only waits on
+    # the first timed maneuver after a slingshot, and other maneuvers only take longer while that
+    # helps the ions
+    waits = [False] * len(route)
+    after = True
+    for i in reversed(range(len(route))):
+        if route[i].slingshot or times[i] is False:
+            after = after or bool(route[i].slingshot)
+        else:
+            waits[i], after = after, False
+    suffixes = suffix_cache()
+    settings = (planner.load, caps, planner.time[1], planner.year)
+    signature = tuple((d, times[i] is not False, min_times[i], m in detach, calendar.years.get(i), waits[i]) for i, (d, m) in enumerate(zip(diffs, route)))
+
+    limit = minimize_value + planner.load if minimize == "mass" and minimize_value is not None else minimize_value
+    candidates = []
+    for ion in range(planner.ion[0], planner.ion[1] + 1):
+        ion_cost = cost(ion=ion, free_ions=planner.free_ions)
+        states = {(planner.load, 0, 0, None, None): None}
+        history = []
+        for i, maneuver in enumerate(route):
+            layer = suffixes.get((settings, ion, signature[:i+1]))
+            if layer is None:
+                ion_mass = 0 if maneuver in detach else ion*ION_WEIGHT
+                following = {}
+                for (load, rockets_cost, t_time, arrival, last) in states:
+                    need = diffs[i]*(load + ion_mass)
+                    longest = planner.time[1] - t_time
+                    if arrival is not None:
+                        longest = min(longest, arrival - planner.year - t_time)
+                    if times[i] is False or maneuver.slingshot:
+                        durations = [min_times[i]]
+                    elif arrival is not None and waits[i]:
+                        durations = range(min_times[i], longest + 1) # waiting for the next slingshot
+                    elif ion:
+                        durations = range(min_times[i], max(min(longest, -(-need // (ion*ION_THRUST))), min_times[i]) + 1)
+                    else:
+                        durations = [min_times[i]]
+                    for duration in durations:
+                        if duration > longest:
+                            continue
+                        arrivals = [arrival]
+                        if maneuver.slingshot:
+                            if arrival is None:
+                                arrivals = [year + t_time + duration for year in calendar.years[i]]
+                            elif arrival - t_time - duration not in calendar.years[i]:
+                                continue
+                        combinations = _combinations(diffs[i], need - ion*ION_THRUST*duration, caps)
+                        for a in arrivals:
+                            for m, c, counts in combinations:
+                                key = (load + m, rockets_cost + c, t_time + duration, a, duration if i == 0 else last)
+                                if key not in following:
+                                    following[key] = ((load, rockets_cost, t_time, arrival, last), counts, duration)
+                layer = _prune_years(following)
+                suffixes.put((settings, ion, signature[:i+1]), layer)
+            states = layer
+            history.append(states)
+            if not states:
+                break
+
+        for key in states:
+            load, rockets_cost, t_time, arrival, last = key
+            t_cost = rockets_cost + ion_cost
+            if planner.cost and t_cost > planner.cost[1]:
+                continue
+            arrival = planner.year + t_time if arrival is None else arrival
+            if arrival - t_time < planner.year:
+                continue
+            value = objective(minimize, t_cost, load, t_time)
+            if minimize_value is not None and value[0] > limit:
+                continue
+            value += (arrival - (last or 0), t_time - arrival)
+            candidates.append((value, ion, history, key))
+    candidates.sort(key=lambda c: c[0])
+    return candidates
+
+"""
+Find the rockets, ions and times for the (reversed) route. detach lists the maneuvers after which
+ion thrusters are left behind. Returns an assignment of the same variables that Planner._plan
+uses (juno__0, time__0, ..., ion), None if the route can not be flown, or UNDECIDED.
+"""
+def allocate(planner, route, detach, minimize=None, minimize_value=None):
+    candidates = _search(planner, route, detach, minimize, minimize_value)
+    if not candidates:
+        return None
+    caps = tuple(getattr(planner, rocket)[1] for rocket in ROCKETS)
+    # any of the equally good allocations will do, as long as it keeps to the rocket limits
+    for value, ion, history, key in candidates:
+        if value != candidates[0][0]:
+            log.debug("The best allocation uses more rockets than allowed")
+            return UNDECIDED
+        used, stages = _rockets(history, key)
+        if all(u <= c for u, c in zip(used, caps)):
+            break
+    else:
+        return UNDECIDED
+
+    timed = [m.get_time(planner.aerobraking) is not False for m in route]
+    assignment = {"ion": ion}
+    padding = max(planner.time[0] - key[2], 0)
+    if planner.year:
+        year = key[3] if key[3] is not None else planner.year + key[2]
+    for i, (counts, duration) in enumerate(stages):
+        if padding and timed[i]:
+            duration += padding
+            padding = 0
+        for rocket, n in zip(ROCKETS, counts):
+            assignment["{}__{}".format(rocket, i)] = n
+        assignment["time__{}".format(i)] = duration
+        if planner.year:
+            year -= duration
+            assignment["year__{}".format(i)] = year
+    return assignment
+
+"""
+A lower bound on the minimize target of any mission on the (reversed) route, or inf if the route
+can not be flown. It is the optimum of the route with the starting year, slingshot windows, lower
+limits on rockets and cost and the totals of each rocket type left out (and slingshots allowed to
+take longer than their fixed time), which is exact for the routes that allocate() solves. With a
+starting year, the time is also at least the shortest schedule in the route's slingshot calendar.
+A mass bound includes the payload.
+"""
+def lower_bound(planner, route, detach, minimize):
+    if not objective(minimize, 0, 0, 0):
+        return 0
+    shortest = route_calendar(planner, route).shortest if planner.year else 0
+    if shortest > planner.time[1]:
+        return inf
+    candidates = _search(planner, route, detach, minimize, years=False)
+    if not candidates:
+        return inf
+    bound = candidates[0][0][0]
+    return max(bound, shortest) if minimize == "time" else bound
+
@@ -0,0 +1,179 @@
+from hashlib import sha256
+from .location import DEFAULT_GRAPH
+from .mission import pack, unpack
+from . import util
+import sqlite3
+import threading
+import mmap
+import struct
+import json
+import time
+import os
+import logging
+log = logging.getLogger("les")
+
+"""
+The directory for les's cache files, under $XDG_CACHE_HOME (or ~/.cache).
+"""
+def cache_dir():
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(root, "les")
+
+"""
+Memory-map the table file at path if it starts with header, otherwise return None.
+"""
+def open_table(path, header):
+    try:
+        with open(path, "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError): # ValueError for an empty file
+        return None
+    if m[:len(header)] != header:
+        m.close()
+        return None
+    return m
+
+"""
+Write data to the table file at path for later runs. The cache is not required, so if the file
+can not be written this only logs a warning and returns False.
+"""
+def write_table(path, data, name="table"):
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError as e:
+        log.warning("Could not write {} {}: {}".format(name, path, e))
+        return False
+    return True
+
+"""
+The contents of a table file in the cache directory, starting with header: the file at path,
+memory-mapped, or else header followed by what build() returns, which is written to path. If the
+file can not be written, the table is not built at all and None is returned, so that callers
+work out the entries they need themselves rather than build the table on every run.
+"""
+def cached_table(path, header, build, name="table"):
+    table = open_table(path, header)
+    if table is None:
+        directory = os.path.dirname(path) or "."
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if not os.access(directory, os.W_OK):
+                raise PermissionError("{} is not writable".format(directory))
+        except OSError as e:
+            log.warning("Not building {} {}: {}".format(name, path, e))
+            return None
+        log.info("Building {} {}".format(name, path))
+        table = header + build()
+        write_table(path, table, name)
+    return table
+
+"""
+The default location of the mission cache.
+"""
+def default_cache_path():
+    return os.path.join(cache_dir(), "missions.sqlite")
+
+"""
+A hash of the rocket constants in les.util, so that cached results are dropped when they change.
+"""
+def constants_key():
+    constants = sorted((k, v) for k, v in vars(util).items() if k.isupper())
+    return sha256(repr(constants).encode()).hexdigest()
+
+"""
+A persistent cache of the missions returned by Planner.plan, stored in SQLite.
+
+Entries are keyed by a hash of the planner's normalized parameters (which include the key of its
+map), the optimization target and bound, and the maneuvers of the route, so missions on several
+maps can share a cache. Routes without a solution are cached as well. When the constants in
+les.util or FORMAT change, the whole cache is cleared. Once the
+cache holds more than max_entries missions or max_size bytes, the least recently used ones are
+evicted. Missions are stored in the binary encoding of les.mission, with the locations of graph
+unless get() and put() are given the planner's.
+"""
+class MissionCache:
+    FORMAT = 5 # raised when the missions that are planned for the same query, or their encoding, change
+
+    def __init__(self, path=None, max_entries=100000, max_size=256*1024*1024, graph=DEFAULT_GRAPH):
+        self.path = path or default_cache_path()
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.graph = graph
+        self.version = sha256("{}\0{}".format(constants_key(), self.FORMAT).encode()).hexdigest()
+        self._local = threading.local() # sqlite connections can only be used in their own thread
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def db(self):
+        if getattr(self._local, "db", None) is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            db.execute("CREATE TABLE IF NOT EXISTS missions (key TEXT PRIMARY KEY, mission BLOB, size INTEGER, accessed REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS missions_accessed ON missions (accessed)")
+            row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != self.version:
+                log.debug("Clearing mission cache {}".format(self.path))
+                db.execute("DELETE FROM missions")
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+            db.commit()
+            self._local.db = db
+        return self._local.db
+
+    def key(self, planner, route, minimize=None, minimize_value=None):
+        query = {
+            "planner": type(planner).__name__,
+            "params": planner.params(),
+            "minimize": minimize,
+            "minimize_value": minimize_value,
+            "route": [[m.src.code, m.dst.code] for m in route],
+        }
+        return sha256(json.dumps(query, sort_keys=True).encode()).hexdigest()
+
+    """
+    Return (True, mission) for a cached route, where mission may be None if the route had no
+    solution, or (False, None) if the route is not in the cache.
+    """
+    def get(self, key, graph=None):
+        graph = self.graph if graph is None else graph
+        row = self.db.execute("SELECT mission FROM missions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        self.db.execute("UPDATE missions SET accessed = ? WHERE key = ?", (time.time(), key))
+        self.db.commit()
+        return True, None if row[0] is None else unpack(row[0], graph).to_dict(graph)
+
+    def put(self, key, mission, graph=None):
+        graph = self.graph if graph is None else graph
+        try:
+            data = None if mission is None else pack(mission, graph)
+        except struct.error as e:
+            log.debug("Not caching a mission that does not fit the encoding: {}".format(e))
+            return
+        self.db.execute("INSERT OR REPLACE INTO missions VALUES (?, ?, ?, ?)", (key, data, len(data or b""), time.time()))
+        self._evict()
+        self.db.commit()
+
+    def _evict(self):
+        count, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM missions").fetchone()
+        while count > self.max_entries or size > self.max_size:
+            excess = max(count - self.max_entries, 1)
+            self.db.execute("DELETE FROM missions WHERE key IN (SELECT key FROM missions ORDER BY accessed LIMIT ?)", (excess,))
+            count, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM missions").fetchone()
+
+    def clear(self):
+        self.db.execute("DELETE FROM missions")
+        self.db.commit()
@@ -0,0 +1,68 @@
+from functools import lru_cache
+from math import inf
+
+"""
+The slingshot calendar of a (reversed) route: every way of timing its slingshots from a starting
+year, within a time range.
+
+A schedule gives the year of every slingshot maneuver (in route order). Slingshots take a fixed
+time and have to start in one of their years, other timed maneuvers take at least their time,
+so the mission can wait on them, and maneuvers without a time take none. The mission may start
+in any year from the starting year on. The slingshot years are limited to the time range after
+the starting year, as in the z3 model.
+
+slingshots are the indices of the slingshot maneuvers, schedules the feasible years for each of
+them, years the feasible years of each slingshot maneuver (by index) and shortest the least total
+time of any schedule (inf if there are none).
+"""
+class Calendar():
+    def __init__(self, slingshots, schedules, shortest):
+        self.slingshots = slingshots
+        self.schedules = schedules
+        self.years = {i: tuple(sorted(set(s[k] for s in schedules))) for k, i in enumerate(slingshots)}
+        self.shortest = shortest
+
+"""
+The calendar of a (reversed) route for a planner with a starting year.
+"""
+def route_calendar(planner, route):
+    # maneuvers without a time are None rather than False, which would be the same key as 0
+    timing = tuple((_none(m.get_time(planner.aerobraking)), tuple(m.slingshot) if m.slingshot else None) for m in route)
+    return calendar(timing, planner.year, tuple(planner.time))
+
+def _none(duration):
+    return None if duration is False else duration
+
+"""
+The calendar for the (time or None, slingshot years) of every maneuver of a reversed route,
+cached per route timing, starting year and time range.
+"""
+@lru_cache(maxsize=4096)
+def calendar(timing, year, time):
+    slingshots = tuple(i for i in reversed(range(len(timing))) if timing[i][1])
+    schedules = {}
+
+    # start is None until the first slingshot, and earliest is the time spent until then
+    def walk(i, start, earliest, exact, years):
+        if i < 0:
+            total = earliest - start if start is not None else earliest
+            if total <= time[1]:
+                schedules[years] = min(schedules.get(years, inf), total)
+            return
+        duration, windows = timing[i]
+        if windows:
+            for y in windows:
+                if y < year or y > year + time[1]:
+                    continue
+                if start is None:
+                    if y - earliest >= year:
+                        walk(i - 1, y - earliest, y + duration, True, years + (y,))
+                elif y == earliest or (y > earliest and not exact):
+                    walk(i - 1, start, y + duration, True, years + (y,))
+        elif duration is None:
+            walk(i - 1, start, earliest, exact, years)
+        else:
+            walk(i - 1, start, earliest + duration, False, years)
+
+    walk(len(timing) - 1, None, 0, False, ())
+    return Calendar(slingshots, tuple(sorted(schedules)), min(schedules.values(), default=inf))
@@ -0,0 +1,197 @@
+from functools import lru_cache
+from hashlib import sha256
+from itertools import product
+from bisect import bisect_left
+from .util import JUN_THRUST, ATL_THRUST, SYZ_THRUST, PRT_THRUST, SAT_THRUST, ION_THRUST
+from .util import JUN_WEIGHT, ATL_WEIGHT, SYZ_WEIGHT, PRT_WEIGHT, SAT_WEIGHT, ION_WEIGHT
+from .util import JUN_COST, ATL_COST, SYZ_COST, PRT_COST, SAT_COST, DEFAULT_COMPONENT_MAX
+from .cache import cache_dir, cached_table, constants_key
+import struct
+import os
+import logging
+log = logging.getLogger("les")
+
+ROCKETS = ("juno", "atlas", "soyuz", "proton", "saturn")
+THRUST = (JUN_THRUST, ATL_THRUST, SYZ_THRUST, PRT_THRUST, SAT_THRUST)
+WEIGHT = (JUN_WEIGHT, ATL_WEIGHT, SYZ_WEIGHT, PRT_WEIGHT, SAT_WEIGHT)
+COST = (JUN_COST, ATL_COST, SYZ_COST, PRT_COST, SAT_COST)
+DEFAULT_CAPS = (DEFAULT_COMPONENT_MAX,) * len(ROCKETS)
+MAX_DIFFICULTY = 10
+
+"""
+The largest net thrust (thrust less the difficulty times their own mass) that rockets can give.
+"""
+def max_need(diff, caps=DEFAULT_CAPS):
+    return sum(cap * max(THRUST[r] - diff*WEIGHT[r], 0) for r, cap in enumerate(caps))
+
+"""
+The rocket combinations that are Pareto-optimal in (mass, cost) among those whose net thrust
+covers need, using at most caps of each rocket. Each is returned as (mass, cost, counts), ordered
+by mass (so the first one has the least mass and the last one the least cost).
+"""
+@lru_cache(maxsize=65536)
+def combinations(diff, need, caps=DEFAULT_CAPS):
+    if need <= 0:
+        return ((0, 0, (0,) * len(ROCKETS)),)
+    nets = [THRUST[r] - diff*WEIGHT[r] for r in range(len(ROCKETS))]
+    useful = [r for r in range(len(ROCKETS)) if nets[r] > 0 and caps[r] > 0]
+    found = []
+
+    # only componentwise-minimal combinations can be Pareto-optimal
+    def walk(k, counts, total):
+        if total >= need or k == len(useful):
+            if total >= need and all(total - nets[r] < need for r in useful if counts[r]):
+                found.append((sum(c*w for c, w in zip(counts, WEIGHT)), sum(c*p for c, p in zip(counts, COST)), tuple(counts)))
+            return
+        r = useful[k]
+        for n in range(caps[r] + 1):
+            counts[r] = n
+            walk(k + 1, counts, total + n*nets[r])
+            if total + n*nets[r] >= need:
+                break
+        counts[r] = 0
+
+    walk(0, [0] * len(ROCKETS), 0)
+    frontier = []
+    for combination in sorted(found):
+        if not frontier or combination[1] < frontier[-1][1]:
+            frontier.append(combination)
+    return tuple(frontier)
+
+"""
+The same frontiers as combinations(diff, need, caps) for every need from 1 to max_need(diff, caps),
+found in one sweep: every combination of useful rockets is added in order of decreasing net
+thrust to a (mass, cost) staircase, which is the frontier for every need down to that thrust.
+"""
+def all_combinations(diff, caps=DEFAULT_CAPS):
+    nets = [THRUST[r] - diff*WEIGHT[r] for r in range(len(ROCKETS))]
+    useful = [r for r in range(len(ROCKETS)) if nets[r] > 0 and caps[r] > 0]
+    found = []
+    for picked in product(*(range(caps[r] + 1) for r in useful)):
+        counts = [0] * len(ROCKETS)
+        for r, n in zip(useful, picked):
+            counts[r] = n
+        found.append((sum(c*n for c, n in zip(counts, nets)), sum(c*w for c, w in zip(counts, WEIGHT)), sum(c*p for c, p in zip(counts, COST)), tuple(counts)))
+    found.sort(key=lambda f: -f[0])
+
+    masses, costs, stair = [], [], []
+    frontiers = []
+    j = 0
+    for need in range(max_need(diff, caps), 0, -1):
+        while j < len(found) and found[j][0] >= need:
+            _, m, c, counts = found[j]
+            j += 1
+            i = bisect_left(masses, m)
+            if i > 0 and costs[i-1] <= c:
+                continue
+            if i < len(masses) and masses[i] == m and (costs[i], stair[i][2]) <= (c, counts):
+                continue
+            end = i
+            while end < len(masses) and costs[end] >= c:
+                end += 1
+            masses[i:end] = [m]
+            costs[i:end] = [c]
+            stair[i:end] = [(m, c, counts)]
+        frontiers.append(tuple(stair))
+    frontiers.reverse()
+    return frontiers
+
+"""
+A table of the (mass, cost) Pareto-optimal rocket combinations for a single maneuver, for every
+difficulty from 0 to MAX_DIFFICULTY and every need that the rockets can cover with the default
+component limits. Need is the thrust the rockets have to provide beyond lifting themselves, i.e.
+difficulty * (load + ions) - ion thrust * time, so one entry serves every (load, ions, time)
+combination with that need.
+
+The table is built on first use and written to the cache directory; later runs memory-map the
+file and only decode the entries they look up. If the cache directory can not be written, each
+entry is found with combinations() instead.
+"""
+class FrontierTable:
+    MAGIC = b"LESF1"
+    RECORD = struct.Struct("<HH5B")
+
+    def __init__(self, path=None):
+        self.key = sha256((constants_key() + repr(DEFAULT_CAPS)).encode()).hexdigest()
+        self.path = path or os.path.join(cache_dir(), "frontier-{}.bin".format(self.key[:16]))
+        self.bases = []
+        base = 0
+        for diff in range(MAX_DIFFICULTY + 1):
+            self.bases.append(base)
+            base += max_need(diff) + 1
+        self.size = base
+        self._map = None
+        self._offsets = None
+        self._records = None
+        self._entries = {}
+
+    def _load(self):
+        if self._map is not None:
+            return
+        header = self.MAGIC + self.key.encode()
+        table = cached_table(self.path, header, self._build, "rocket frontier table")
+        if table is None:
+            self._map = False
+            return
+        self._map = table
+        self._offsets = memoryview(table)[len(header):len(header) + 4*(self.size + 1)].cast("I")
+        self._records = len(header) + 4*(self.size + 1)
+
+    def _build(self):
+        offsets = [0]
+        records = bytearray()
+        for diff in range(MAX_DIFFICULTY + 1):
+            for frontier in [combinations(diff, 0)] + all_combinations(diff):
+                for m, c, counts in frontier:
+                    records += self.RECORD.pack(m, c, *counts)
+                offsets.append(len(records) // self.RECORD.size)
+        return struct.pack("<{}I".format(len(offsets)), *offsets) + bytes(records)
+
+    """
+    The Pareto-optimal combinations for a need, like combinations(diff, need) with the default
+    component limits.
+    """
+    def lookup(self, diff, need):
+        if need <= 0 or diff > MAX_DIFFICULTY:
+            return combinations(diff, need)
+        if need > max_need(diff):
+            return ()
+        entry = self._entries.get((diff, need))
+        if entry is None:
+            self._load()
+            if self._map is False: # no table in the cache directory
+                return combinations(diff, need)
+            i = self.bases[diff] + need
+            entry = tuple((m, c, tuple(counts)) for m, c, *counts in
+                          (self.RECORD.unpack_from(self._map, self._records + self.RECORD.size*n)
+                           for n in range(self._offsets[i], self._offsets[i+1])))
+            self._entries[(diff, need)] = entry
+        return entry
+
+    def _need(self, diff, load, ion=0, time=0):
+        return diff*(load + ion*ION_WEIGHT) - ion*ION_THRUST*time
+
+    """
+    The (mass, cost, counts) of the cheapest rockets for a maneuver, or None if it can not be done.
+    """
+    def min_cost(self, diff, load, ion=0, time=0):
+        entry = self.lookup(diff, self._need(diff, load, ion, time))
+        return entry[-1] if entry else None
+
+    """
+    The (mass, cost, counts) of the lightest rockets for a maneuver, or None if it can not be done.
+    """
+    def min_mass(self, diff, load, ion=0, time=0):
+        entry = self.lookup(diff, self._need(diff, load, ion, time))
+        return entry[0] if entry else None
+
+_table = None
+
+"""
+The shared frontier table for the default component limits.
+"""
+def frontier_table():
+    global _table
+    if _table is None:
+        _table = FrontierTable()
+    return _table
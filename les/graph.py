@@ -0,0 +1,251 @@
+from array import array
+from hashlib import sha256
+from math import sqrt, inf
+from heapq import heappush, heappop
+from types import MappingProxyType
+
+NO_TIME = -1
+
+"""
+A compiled, read-only form of a map of locations: every location and maneuver gets an integer
+id, the maneuvers leaving each location are stored CSR-style (the maneuvers of location n are
+edge ids offsets[n] to offsets[n+1]) and the difficulty and time of every maneuver are kept in
+flat columns so that searching and scoring do not touch the _Location/_Maneuver objects.
+Times are stored as NO_TIME when the maneuver can not take time.
+
+codes are the locations by code. single_stage is None or the edge ids of the direct launch and of
+the two maneuvers it replaces (e.g. E -> Eo and E -> Eso, Eso -> Eo), and skip the edges that
+route searches do not start with. Graphs can not be changed once they are built, and are equal
+(and hash the same) when their keys are, so they can key caches themselves. A graph pickles as
+its map, which gives back the graph that the receiving process already has for it, if any.
+"""
+class Graph:
+    __slots__ = ("name", "locations", "maneuvers", "codes", "node_ids", "edge_ids", "offsets", "src", "dst",
+                 "diff", "time", "ab_diff", "ab_time", "slingshot", "diffs", "times", "single_stage", "skip",
+                 "_distances", "key")
+
+    def __init__(self, locations, single_stage=None, name=None):
+        self.name = name
+        self.locations = tuple(locations.values())
+        self.codes = MappingProxyType({l.code: l for l in self.locations})
+        self.node_ids = MappingProxyType({l: i for i, l in enumerate(self.locations)})
+        self.maneuvers = tuple(m for l in self.locations for m in l.maneuvers)
+        self.edge_ids = MappingProxyType({m: i for i, m in enumerate(self.maneuvers)})
+
+        offsets = array("i", [0])
+        for l in self.locations:
+            offsets.append(offsets[-1] + len(l.maneuvers))
+        self.offsets = offsets
+        self.src = array("i", (self.node_ids[m.src] for m in self.maneuvers))
+        self.dst = array("i", (self.node_ids[m.dst] for m in self.maneuvers))
+        self.diff = array("i", (m.diff for m in self.maneuvers))
+        self.time = array("i", (_time(m.time) for m in self.maneuvers))
+        self.ab_diff = array("i", (NO_TIME if m.ab_diff is None else m.ab_diff for m in self.maneuvers))
+        self.ab_time = array("i", (_time(m.ab_time) for m in self.maneuvers))
+        self.slingshot = array("b", (m.slingshot is not None for m in self.maneuvers))
+
+        # effective difficulty and time of each maneuver, indexed by the aerobraking flag
+        self.diffs = (self.diff, array("i", (m.get_diff(True) for m in self.maneuvers)))
+        self.times = (self.time, array("i", (_time(m.get_time(True)) for m in self.maneuvers)))
+
+        self.single_stage = None
+        self.skip = ()
+        if single_stage:
+            if any(code not in self.codes for code in single_stage):
+                raise Exception("Unknown location in the single stage launch {}.".format(" -> ".join(single_stage)))
+            first, middle, last = (self.node_ids[self.codes[code]] for code in single_stage)
+            edges = (self.edge(first, last), self.edge(first, middle), self.edge(middle, last))
+            if None in edges:
+                raise Exception("The single stage launch {} is missing maneuvers.".format(" -> ".join(single_stage)))
+            self.single_stage = edges
+            self.skip = edges[:1] # don't use single-stage routes
+        self._distances = {}
+        self.key = self._fingerprint()
+
+    def __setattr__(self, name, value):
+        if hasattr(self, "key"):
+            raise Exception("A graph can not be changed.")
+        object.__setattr__(self, name, value)
+
+    def __eq__(self, other):
+        return isinstance(other, Graph) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __reduce__(self):
+        from .location import parse_map
+        return parse_map, (self.to_map(),)
+
+    """
+    A hash of the name of the map and everything in it that affects routes and missions, used to
+    key caches on the map.
+    """
+    def _fingerprint(self):
+        h = sha256()
+        h.update("{!r}\0".format(self.name).encode())
+        for l in self.locations:
+            h.update("{}\0{}\0".format(l.code, l.name).encode())
+        for column in (self.offsets, self.dst, self.diff, self.time, self.ab_diff, self.ab_time):
+            h.update(column.tobytes())
+        for m in self.maneuvers:
+            h.update(repr(list(m.slingshot or [])).encode())
+        h.update(repr(self.single_stage).encode())
+        return h.hexdigest()
+
+    """
+    The map that the graph was built from, as location.parse_map takes it.
+    """
+    def to_map(self):
+        maneuvers = []
+        for m in self.maneuvers:
+            maneuver = {"origin": m.src.code, "destination": m.dst.code, "difficulty": m.diff}
+            if m.time is not False:
+                maneuver["time"] = m.time
+            if m.ab_diff is not None:
+                maneuver["aerobraking"] = {"difficulty": m.ab_diff}
+                if m.ab_time is not False:
+                    maneuver["aerobraking"]["time"] = m.ab_time
+            if m.slingshot is not None:
+                maneuver["slingshot"] = list(m.slingshot)
+            maneuvers.append(maneuver)
+        data = {"locations": [{"code": l.code, "name": l.name} for l in self.locations], "maneuvers": maneuvers}
+        if self.name is not None:
+            data["name"] = self.name
+        if self.single_stage:
+            direct, first, second = (self.maneuvers[e] for e in self.single_stage)
+            data["single_stage"] = [first.src.code, first.dst.code, second.dst.code]
+        return data
+
+    def __len__(self):
+        return len(self.locations)
+
+    def edges(self, node):
+        return range(self.offsets[node], self.offsets[node+1])
+
+    def edge(self, src, dst):
+        for e in self.edges(src):
+            if self.dst[e] == dst:
+                return e
+
+    def route(self, edges):
+        return [self.maneuvers[e] for e in edges]
+
+    def score(self, edges, aerobraking=False):
+        diffs = self.diffs[aerobraking]
+        times = self.times[aerobraking]
+        return sum(sqrt(i+10.0)*diffs[e] + max(times[e], 0) for i, e in enumerate(edges))
+
+    """
+    Lower bounds on the remaining difficulty and time from every node to dst, ignoring the
+    restriction that a path may not revisit a location. Unreachable nodes are inf.
+    """
+    def distances(self, dst, aerobraking=False):
+        key = (dst, aerobraking)
+        if key not in self._distances:
+            self._distances[key] = (self._dijkstra(dst, self.diffs[aerobraking]),
+                                    self._dijkstra(dst, array("i", (max(t, 0) for t in self.times[aerobraking]))))
+        return self._distances[key]
+
+    def _dijkstra(self, dst, weights):
+        dist = [inf] * len(self)
+        dist[dst] = 0
+        incoming = [[] for _ in self.locations]
+        for e in range(len(self.maneuvers)):
+            incoming[self.dst[e]].append(e)
+        queue = [(0, dst)]
+        while queue:
+            d, node = heappop(queue)
+            if d > dist[node]:
+                continue
+            for e in incoming[node]:
+                nd = d + weights[e]
+                if nd < dist[self.src[e]]:
+                    dist[self.src[e]] = nd
+                    heappush(queue, (nd, self.src[e]))
+        return dist
+
+    """
+    Yield (score, edges) for every simple path from src to dst in order of score, where edges is
+    a tuple of edge ids. Ties keep the order of a depth-first search, which is the lexicographic
+    order of the edge ids. Edges in skip are never used as the first maneuver.
+
+    The position weight sqrt(i+10) makes the score of a maneuver depend on how far into the path
+    it is, so instead of a spur-path (Yen) decomposition this runs a best-first (A*) search over
+    partial paths. Every term of the score is non-negative and the remaining distance bound is
+    admissible, so complete paths come off the queue in score order.
+    """
+    def search(self, src, dst, aerobraking=False, skip=()):
+        diff_dist, time_dist = self.distances(dst, aerobraking)
+        if diff_dist[src] == inf:
+            return
+        diffs = self.diffs[aerobraking]
+        times = self.times[aerobraking]
+        offsets = self.offsets
+        targets = self.dst
+
+        queue = [(0, (), 0, src, 1 << src)]
+        while queue:
+            f, edges, g, node, visited = heappop(queue)
+            if node == dst:
+                yield g, edges
+                continue
+            depth = len(edges)
+            weight = sqrt(depth+10.0)
+            next_weight = sqrt(depth+11.0)
+            for e in range(offsets[node], offsets[node+1]):
+                n = targets[e]
+                if visited & (1 << n) or diff_dist[n] == inf or (depth == 0 and e in skip):
+                    continue
+                ng = g + (weight*diffs[e] + max(times[e], 0))
+                # the slack keeps the bound admissible despite floating point rounding in the sums
+                h = (next_weight*diff_dist[n] + time_dist[n]) * (1 - 1e-9)
+                heappush(queue, (ng + h, edges + (e,), ng, n, visited | (1 << n)))
+
+    """
+    The same search as search() from src to every node in dsts at once, over one shared search
+    tree: yield (dst, score, edges) for every simple path to each of them, in order of score for
+    each dst. A path that reaches a destination is also extended towards the others. Removing a
+    node from dsts (which has to be a set) while iterating stops the search for it, and the
+    search ends when dsts is empty.
+
+    The remaining distance bound of a partial path is the least of its bounds to the destinations
+    that are left, which is admissible for each of them, so every destination gets its paths in
+    the same order as it would from search() (up to paths with the same score).
+    """
+    def search_many(self, src, dsts, aerobraking=False, skip=()):
+        bounds = {dst: self.distances(dst, aerobraking) for dst in dsts}
+        diffs = self.diffs[aerobraking]
+        times = self.times[aerobraking]
+        offsets = self.offsets
+        targets = self.dst
+
+        def remaining(node, weight):
+            return min((weight*diff_dist[node] + time_dist[node] for dst, (diff_dist, time_dist) in bounds.items()
+                        if dst in dsts), default=inf)
+
+        queue = [(0, (), 0, src, 1 << src)]
+        while queue and dsts:
+            f, edges, g, node, visited = heappop(queue)
+            if node in dsts and edges:
+                yield node, g, edges
+                if not dsts:
+                    return
+            depth = len(edges)
+            weight = sqrt(depth+10.0)
+            next_weight = sqrt(depth+11.0)
+            for e in range(offsets[node], offsets[node+1]):
+                n = targets[e]
+                if visited & (1 << n) or (depth == 0 and e in skip):
+                    continue
+                h = remaining(n, next_weight)
+                if h == inf:
+                    continue
+                ng = g + (weight*diffs[e] + max(times[e], 0))
+                # the slack keeps the bound admissible despite floating point rounding in the sums
+                heappush(queue, (ng + h * (1 - 1e-9), edges + (e,), ng, n, visited | (1 << n)))
+
+def _time(time):
+    if time is False or time is None:
+        return NO_TIME
+    return time
@@ -0,0 +1,98 @@
+from .util import ION_THRUST, ION_WEIGHT
+from .frontier import ROCKETS, THRUST, WEIGHT, COST
+from .calendar import route_calendar
+
+"""
+A quick, not necessarily optimal, assignment for a (reversed) route in the same form as
+allocator.allocate() (juno__0, time__0, ..., ion), for z3 to start from.
+
+Working backwards from the last maneuver, every maneuver gets the rocket with the best ratio of
+net thrust (its thrust less the difficulty times its own mass) to cost (or to mass when
+minimizing mass) until the rest of the thrust it needs is covered by a single rocket, and then
+the cheapest rocket that covers it. Ion thrusters are kept to the planner's minimum. Maneuvers take
+their own time, and with a starting year the route follows the earliest schedule of its slingshot
+calendar, waiting on the timed maneuver before each slingshot. Returns None if the rockets run
+out or there is no schedule; the assignment may still break the planner's other limits.
+"""
+def greedy(planner, route, detach, minimize=None):
+    price = WEIGHT if minimize == "mass" else COST
+    left = [getattr(planner, rocket)[1] for rocket in ROCKETS]
+    ion = planner.ion[0]
+    times = _times(planner, route)
+    if times is None:
+        return None
+
+    assignment = {"ion": ion}
+    load = planner.load
+    for i, maneuver in enumerate(route):
+        d = maneuver.get_diff(planner.aerobraking)
+        counts = [0] * len(ROCKETS)
+        nets = [THRUST[r] - d*WEIGHT[r] for r in range(len(ROCKETS))]
+        ions = 0 if maneuver in detach else ion*ION_WEIGHT
+        deficit = d*(load + ions) - ion*ION_THRUST*times[i]
+        while deficit > 0:
+            usable = [r for r in range(len(ROCKETS)) if left[r] > 0 and nets[r] > 0]
+            if not usable:
+                return None
+            covering = [r for r in usable if nets[r] >= deficit]
+            if covering:
+                r = min(covering, key=lambda r: price[r])
+            else:
+                r = max(usable, key=lambda r: nets[r] / price[r])
+            counts[r] += 1
+            left[r] -= 1
+            deficit -= nets[r]
+        for rocket, n in zip(ROCKETS, counts):
+            assignment["{}__{}".format(rocket, i)] = n
+        assignment["time__{}".format(i)] = times[i]
+        load += sum(n*WEIGHT[r] for r, n in enumerate(counts))
+
+    if planner.year:
+        year = _start(planner, route, times)
+        for i in reversed(range(len(route))):
+            assignment["year__{}".format(i)] = year
+            year += times[i]
+    return assignment
+
+"""
+The time of every maneuver of the (reversed) route, with the waits that the earliest slingshot
+schedule needs and the padding up to the planner's least time, or None if there is no schedule.
+"""
+def _times(planner, route):
+    times = [m.get_time(planner.aerobraking) or 0 for m in route]
+    timed = [m.get_time(planner.aerobraking) is not False and not m.slingshot for m in route]
+    wait = None # the timed maneuver that the mission waits on for the next slingshot
+    if planner.year:
+        calendar = route_calendar(planner, route)
+        if not calendar.schedules:
+            return None
+        years = dict(zip(calendar.slingshots, calendar.schedules[0]))
+        year = _start(planner, route, times, years)
+        for i in reversed(range(len(route))):
+            if i in years:
+                if years[i] > year:
+                    times[wait] += years[i] - year
+                year = years[i]
+                wait = None
+            elif timed[i]:
+                wait = i
+            year += times[i]
+    else:
+        wait = next((i for i in range(len(route)) if timed[i]), None)
+    padding = planner.time[0] - sum(times)
+    if padding > 0 and wait is not None:
+        times[wait] += padding
+    return times
+
+"""
+The starting year of the (reversed) route: the year of its first slingshot less the time before
+it, or the planner's year if it has no slingshots.
+"""
+def _start(planner, route, times, years=None):
+    if years is None:
+        calendar = route_calendar(planner, route)
+        years = dict(zip(calendar.slingshots, calendar.schedules[0]))
+    if not years:
+        return planner.year
+    first = max(years)
+    return years[first] - sum(times[first+1:])
@@ -0,0 +1,121 @@
+from hashlib import sha256
+from .cache import cache_dir, open_table, write_table
+import struct
+import os
+import logging
+log = logging.getLogger("les")
+
+"""
+An all-pairs index of the best routes of a graph, for both aerobraking settings.
+
+For every pair of locations the index keeps the routes that Graph.search yields first: at least
+the best RANKS of them and every route whose score is within OPTIMAL times the best score, which
+covers what find_best_paths needs for every route filter apart from "all". build() stores the
+routes of every pair as (score, edge ids) in a compact binary file in the cache directory, keyed
+on the graph, which later runs memory-map and only decode the pairs they look up. Building it
+takes seconds, so without the file each pair is searched when it is first looked up instead.
+"""
+class RouteIndex:
+    MAGIC = b"LESR1"
+    RANKS = 31
+    MAX_MANEUVERS = 256 # edge ids are stored in a byte
+    OPTIMAL = 1.2
+    ROUTE = struct.Struct("<dB")
+
+    def __init__(self, graph, skip=(), path=None):
+        self.graph = graph
+        self.skip = tuple(skip)
+        self.key = sha256("{}\0{}\0{}\0{}".format(graph.key, self.skip, self.RANKS, self.OPTIMAL).encode()).hexdigest()
+        self.path = path or os.path.join(cache_dir(), "routes-{}.bin".format(self.key[:16]))
+        self._map = None
+        self._offsets = None
+        self._records = None
+        self._entries = {}
+
+    def _load(self):
+        if self._map is None:
+            header = self.MAGIC + self.key.encode()
+            table = open_table(self.path, header)
+            if table is None:
+                self._map = False
+            else:
+                self._attach(table, len(header))
+
+    def _attach(self, table, header):
+        n = 2 * len(self.graph)**2 + 1
+        self._map = table
+        self._offsets = memoryview(table)[header:header + 4*n].cast("I")
+        self._records = header + 4*n
+
+    """
+    Whether the routes of every pair are indexed, from the cache directory or by build().
+    """
+    def built(self):
+        self._load()
+        return self._map is not False
+
+    """
+    Index the routes of every pair and write the index to the cache directory. Returns False if
+    it could not be written, in which case it is only kept in memory.
+    """
+    def build(self):
+        header = self.MAGIC + self.key.encode()
+        log.info("Building route index {}".format(self.path))
+        table = header + self._build()
+        written = write_table(self.path, table, "route index")
+        self._attach(table, len(header))
+        self._entries = {}
+        return written
+
+    def _slot(self, src, dst, aerobraking):
+        return (bool(aerobraking)*len(self.graph) + src)*len(self.graph) + dst
+
+    """
+    Find the routes for one pair with the same search as the index is built from.
+    """
+    def search(self, src, dst, aerobraking=False):
+        routes = []
+        for score, edges in self.graph.search(src, dst, aerobraking, self.skip):
+            if routes and len(routes) >= self.RANKS and score > routes[0][0] * self.OPTIMAL:
+                break
+            routes.append((score, edges))
+        return routes
+
+    def _build(self):
+        if len(self.graph.maneuvers) > self.MAX_MANEUVERS:
+            raise ValueError("Too many maneuvers for a route index")
+        offsets = [0]
+        records = bytearray()
+        for aerobraking in (False, True):
+            for src in range(len(self.graph)):
+                for dst in range(len(self.graph)):
+                    if src != dst:
+                        for score, edges in self.search(src, dst, aerobraking):
+                            records += self.ROUTE.pack(score, len(edges)) + bytes(edges)
+                    offsets.append(len(records))
+        return struct.pack("<{}I".format(len(offsets)), *offsets) + bytes(records)
+
+    """
+    The indexed (score, edges) of the routes from src to dst (node ids), best first.
+    """
+    def lookup(self, src, dst, aerobraking=False):
+        key = (src, dst, bool(aerobraking))
+        entry = self._entries.get(key)
+        if entry is None:
+            self._load()
+            if self._map is False:
+                entry = tuple(self.search(src, dst, aerobraking))
+            else:
+                entry = self._decode(self._slot(src, dst, aerobraking))
+            self._entries[key] = entry
+        return entry
+
+    def _decode(self, i):
+        start, end = self._records + self._offsets[i], self._records + self._offsets[i+1]
+        entry = []
+        while start < end:
+            score, n = self.ROUTE.unpack_from(self._map, start)
+            start += self.ROUTE.size
+            entry.append((score, tuple(self._map[start:start + n])))
+            start += n
+        return tuple(entry)
@@ -1,14 +1,35 @@
-from z3 import Optimize, Int, Or, If, unsat, IntVector
-from .util import required, thrust, mass, cost, ION_COST, ION_WEIGHT
+from .util import required, thrust, mass, cost, ION_COST, ION_WEIGHT, DEFAULT_COMPONENT_MAX
+from . import allocator
+from .greedy import greedy
+from .frontier import THRUST, WEIGHT
+from .calendar import route_calendar
+from .location import DEFAULT_GRAPH
+from math import inf
+from contextlib import nullcontext
+import time as clock
 import logging
 log = logging.getLogger("les")
+# z3 is imported by the methods that build and solve models, so that importing les, the CLI's
+# help and errors, and routes that the allocator solves do not pay for loading it
 
-
-DEFAULT_COMPONENT_MAX=8
 RNG=(0,DEFAULT_COMPONENT_MAX)
+VARIABLES=("juno", "atlas", "soyuz", "proton", "saturn", "time", "year")
+ENGINES=("auto", "z3", "dp", "check")
+MAX_SCHEDULES=64 # slingshot schedules that are given to z3 one by one
+HINT_TIMEOUT=1 # seconds that z3 may spend completing a hint
+
+"""
+Order model variables by stage and then by kind so that missions are built the same way no matter
+how z3 happens to order its model. The mission-wide ion variable comes last.
+"""
+def _variable_order(item):
+    if item[0] == "ion":
+        return (inf, 0)
+    key, i = item[0].split("__")
+    return (int(i), VARIABLES.index(key))
 
 class Planner():
-    def __init__(self, load=1, juno=RNG, atlas=RNG, soyuz=RNG, proton=RNG, saturn=RNG, ion=RNG, time=None, year=None, cost=None, free_ions=0, rendezvous=True, aerobraking=False):
+    def __init__(self, load=1, juno=RNG, atlas=RNG, soyuz=RNG, proton=RNG, saturn=RNG, ion=RNG, time=None, year=None, cost=None, free_ions=0, rendezvous=True, aerobraking=False, cache=None, engine="auto", stats=None, timeout=None, hints=False, graph=DEFAULT_GRAPH):
         log.debug("Creating planner")
         self.load = load
         self.juno = juno
@@ -36,6 +57,29 @@ class Planner():
             else:
                 self.time = time
         log.info("Set mission time to between {} and {} years".format(self.time[0], self.time[1]))
+        self.cache = cache
+        if engine not in ENGINES:
+            raise Exception("Engine must be one of {}.".format(", ".join(ENGINES)))
+        self.engine = engine
+        self.stats = stats
+        self.timeout = timeout # seconds that z3 may spend on one route
+        self.deadline = None # time.time() by which every plan has to be done
+        self.interrupted = False # whether the last plan stopped early
+        self.hints = hints # whether z3 starts from the greedy assignment when plan() has no hint
+        self._hint = None
+        self.graph = graph # the map that routes are taken from
+
+    """
+    The normalized parameters of the planner, i.e. everything apart from the route that decides
+    which mission it returns.
+    """
+    def params(self):
+        params = {}
+        for key in ("load", "juno", "atlas", "soyuz", "proton", "saturn", "ion", "time", "year", "cost", "free_ions", "rendezvous", "aerobraking", "engine", "hints"):
+            value = getattr(self, key)
+            params[key] = list(value) if isinstance(value, tuple) else value
+        params["map"] = self.graph.key
+        return params
 
     """
     Find the point in the route where ions can be detached, i.e. when all remaining maneuvers can not take time.
@@ -60,98 +104,153 @@ class Planner():
                 return True
         return False
 
-    def _plan(self, route, minimize=None, minimize_value=None):
-        solver = Optimize()
-
-        ion_detach_maneuvers = self._find_ion_detach_maneuvers(route)
-        slingshot_maneuvers = self._find_slingshot_maneuvers(route)
-        if slingshot_maneuvers:
+    """
+    Check that the route can be flown with the planner's settings.
+    """
+    def _check_route(self, route):
+        if self._find_slingshot_maneuvers(route):
             log.debug("Found slingshot maneuver")
             if not self.year:
                 raise Exception("To perform a slingshot maneuver, a starting year must be specified.")
 
-        a_juno = IntVector("juno", len(route))
-        a_atlas = IntVector("atlas", len(route))
-        a_soyuz = IntVector("soyuz", len(route))
-        a_proton = IntVector("proton", len(route))
-        a_saturn = IntVector("saturn", len(route))
-        a_time = IntVector("time", len(route))
-        if self.year:
-            a_year = IntVector("year", len(route))
-
+    """
+    Create the ion variable with its bounds and the starting running totals of a mission.
+    """
+    def _start(self):
+        from z3 import Int, If
         # ions are allocated per mission not per segment
         ion = Int("ion")
-        solver.add(ion>=self.ion[0])
-        solver.add(ion<=self.ion[1])
-
-        # running totals
-        t_juno = 0
-        t_atlas = 0
-        t_soyuz = 0
-        t_proton = 0
-        t_saturn = 0
-        t_load = self.load
-        t_cost = If(self.free_ions>ion, 0, (ion-self.free_ions)*ION_COST)
-        t_time = 0
-        # add rules for each maneuver (0 is the last maneuver in the route)
-        for i, maneuver in enumerate(route):
-            log.debug("Creating constraint for maneuver {}".format(maneuver))
-            d = maneuver.get_diff(self.aerobraking)
-            juno = a_juno[i]
-            atlas = a_atlas[i]
-            soyuz = a_soyuz[i]
-            proton = a_proton[i]
-            saturn = a_saturn[i]
-            time = a_time[i]
-
-            solver.add(juno>=0, juno<=self.juno[1]) 
-            solver.add(atlas>=0, atlas<=self.atlas[1])
-            solver.add(soyuz>=0, soyuz<=self.soyuz[1])
-            solver.add(proton>=0, proton<=self.proton[1])
-            solver.add(saturn>=0, saturn<=self.saturn[1])
-
-            if slingshot_maneuvers or self.year:
-                if maneuver.get_time(self.aerobraking) is False:
-                    solver.add(time==0)
-                    if i == len(route) - 1:
-                        solver.add(a_year[i]>=self.year)
-                    else:
-                        solver.add(a_year[i]==a_year[i+1])
-                else:
-                    if maneuver.slingshot: # slingshots have fixed duration
-                        solver.add(time==maneuver.get_time(self.aerobraking))
-                        available_years = []
-                        for available_year in maneuver.slingshot:
-                            if available_year >= self.year and available_year <= self.year + self.time[1]:
-                                available_years.append(a_year[i]==available_year)
-                        solver.add(Or(*available_years))
-                    else:
-                        solver.add(time>=maneuver.get_time(self.aerobraking))
-                    if i == len(route) - 1:
-                        solver.add(a_year[i]>=self.year)
-                    else:
-                        solver.add(a_year[i]==a_year[i+1]+a_time[i+1])
-            else:
-                if maneuver.get_time(self.aerobraking) is False:
-                    solver.add(time==0)
-                else:
-                    solver.add(time>=maneuver.get_time(self.aerobraking))
+        constraints = [ion>=self.ion[0], ion<=self.ion[1]]
+
+        # running totals: juno, atlas, soyuz, proton, saturn, load, cost, time
+        totals = (0, 0, 0, 0, 0, self.load, If(self.free_ions>ion, 0, (ion-self.free_ions)*ION_COST), 0)
+        return ion, constraints, totals
 
-            if maneuver in ion_detach_maneuvers:
-                log.debug("Maneuver {} is ion detach point".format(maneuver))
-                solver.add(thrust(juno, atlas, soyuz, proton, saturn, ion, time) >= required(juno, atlas, soyuz, proton, saturn, 0, d, t_load))
+    """
+    Whether rockets that a maneuver does not need can be left out of the model, i.e. there are no
+    lower limits on the rockets or the cost that extra rockets might be needed for.
+    """
+    def _presolves(self):
+        return not any(getattr(self, rocket)[0] > 0 for rocket in allocator.ROCKETS) and not (self.cost and self.cost[0] > 0)
+
+    """
+    An upper bound on what the rockets of any maneuver have to lift apart from themselves: the
+    payload, every rocket the planner allows and the most ions. Subclasses that can not bound the
+    load return None, which only leaves the planner's own limits on the rockets.
+    """
+    def _load_bound(self):
+        return self.load + sum(getattr(self, rocket)[1]*w for rocket, w in zip(allocator.ROCKETS, WEIGHT)) + self.ion[1]*ION_WEIGHT
+
+    """
+    The most of each rocket (in allocator.ROCKETS order) that the maneuver may use. Without lower
+    limits the best mission never has a rocket that it could do without, since dropping it lowers
+    both cost and mass. So rockets are left out of maneuvers without difficulty and rockets that
+    do not lift their own mass, and a rocket with net thrust t (its thrust less the difficulty
+    times its mass) is used at most ceil(d*L/t) times for a difficulty d and a load bound L.
+    """
+    def _caps(self, maneuver):
+        caps = [getattr(self, rocket)[1] for rocket in allocator.ROCKETS]
+        if not self._presolves():
+            return caps
+        d = maneuver.get_diff(self.aerobraking)
+        bound = self._load_bound()
+        for r, cap in enumerate(caps):
+            net = THRUST[r] - d*WEIGHT[r]
+            if d == 0 or net <= 0:
+                caps[r] = 0
+            elif bound is not None:
+                caps[r] = min(cap, -(-d*bound // net))
+        return caps
+
+    """
+    The number of variables in the model of the (reversed) route without and with the presolve,
+    which are logged and recorded in the planner's stats. years is False if the route is encoded
+    without years.
+    """
+    def _size(self, route, years=True):
+        full = len(route)*(len(VARIABLES) - (0 if self.year else 1)) + 1
+        left = 1
+        for maneuver in route:
+            left += sum(1 for cap in self._caps(maneuver) if cap)
+            left += (maneuver.get_time(self.aerobraking) is not False) + bool(self.year and years)
+        log.debug("Presolve left {} of {} variables".format(left, full))
+        if self.stats is not None:
+            self.stats.set(presolve=[full, left])
+        return full, left
+
+    """
+    Return the constraints for maneuver i (0 is the last maneuver in the route) and the running
+    totals after it. The rockets and time that the maneuver can not use are 0 rather than
+    variables (see _caps). It ends in the year that maneuver following (i-1 by default, none for
+    maneuver 0) starts, and the first maneuver (last) starts in the starting year or later. load
+    is what it has to lift apart from its own rockets (by default the running total of the
+    load), and years is False to leave the years out.
+    """
+    def _stage(self, i, maneuver, ion, totals, detach=False, last=False, following=None, load=None, years=True):
+        from z3 import Int, Or
+        log.debug("Creating constraint for maneuver {}".format(maneuver))
+        d = maneuver.get_diff(self.aerobraking)
+        caps = self._caps(maneuver)
+        juno, atlas, soyuz, proton, saturn = (Int("{}__{}".format(k, i)) if cap else 0 for k, cap in zip(allocator.ROCKETS, caps))
+        duration = maneuver.get_time(self.aerobraking)
+        time = 0 if duration is False else Int("time__{}".format(i))
+        t_juno, t_atlas, t_soyuz, t_proton, t_saturn, t_load, t_cost, t_time = totals
+        if following is None and isinstance(i, int) and i > 0:
+            following = i-1
+        if load is None:
+            load = t_load
+        constraints = []
+
+        for rocket, cap in zip((juno, atlas, soyuz, proton, saturn), caps):
+            if cap:
+                constraints += [rocket>=0, rocket<=cap]
+
+        if duration is not False:
+            if maneuver.slingshot and self.year and years: # slingshots have fixed duration
+                constraints.append(time==duration)
             else:
-                solver.add(thrust(juno, atlas, soyuz, proton, saturn, ion, time) >= required(juno, atlas, soyuz, proton, saturn, ion, d, t_load))
+                constraints.append(time>=duration)
+
+        if self.year and years:
+            year = Int("year__{}".format(i))
+            if last:
+                constraints.append(year>=self.year)
+            if following is not None:
+                constraints.append(Int("year__{}".format(following))==year+time)
+            if maneuver.slingshot and duration is not False:
+                available_years = []
+                for available_year in maneuver.slingshot:
+                    if available_year >= self.year and available_year <= self.year + self.time[1]:
+                        available_years.append(year==available_year)
+                constraints.append(Or(*available_years))
+
+        if detach:
+            log.debug("Maneuver {} is ion detach point".format(maneuver))
+        if d > 0: # otherwise any thrust will do
+            constraints.append(thrust(juno, atlas, soyuz, proton, saturn, ion, time) >= required(juno, atlas, soyuz, proton, saturn, 0 if detach else ion, d, load))
 
-            t_juno += juno
-            t_atlas += atlas
-            t_soyuz += soyuz
-            t_proton += proton
-            t_saturn += saturn
-            t_load += mass(juno, atlas, soyuz, proton, saturn, 0) # do not add ions since they only count once
-            t_cost += cost(juno, atlas, soyuz, proton, saturn, 0) # do not add ions since they only count once
-            t_time += time
+        t_juno += juno
+        t_atlas += atlas
+        t_soyuz += soyuz
+        t_proton += proton
+        t_saturn += saturn
+        t_load += mass(juno, atlas, soyuz, proton, saturn, 0) # do not add ions since they only count once
+        t_cost += cost(juno, atlas, soyuz, proton, saturn, 0) # do not add ions since they only count once
+        t_time += time
+        return constraints, (t_juno, t_atlas, t_soyuz, t_proton, t_saturn, t_load, t_cost, t_time)
 
+    """
+    Add the mission-wide limits and the optimization targets for a route of length n, and return
+    the total that minimize_value bounds. With minimize "pareto", cost, mass and time are minimized
+    together and minimize_value is a list of (cost, mass, time) that the mission has to be better
+    than in at least one of them. index gives the index of the variables of maneuver i, if they
+    are not numbered like the route. If the route was encoded without years, last_time is the time
+    of its last maneuver.
+    """
+    def _finish(self, solver, n, totals, minimize=None, minimize_value=None, index=None, last_time=None):
+        from z3 import Int, IntVal, Or
+        # totals that the presolve left without variables are plain numbers
+        t_juno, t_atlas, t_soyuz, t_proton, t_saturn, t_load, t_cost, t_time = (IntVal(t) if isinstance(t, int) else t for t in totals)
         if self.cost:
             solver.add(t_cost>=self.cost[0], t_cost<=self.cost[1]) 
 
@@ -163,42 +262,354 @@ class Planner():
         solver.add(t_time>=self.time[0], t_time<=self.time[1])
 
         log.debug("Setting optimization target")
+        if minimize == "pareto":
+            t_mass = t_load - self.load + Int("ion")*ION_WEIGHT # the mass that missions report
+            solver.set(priority="pareto")
+            solver.minimize(t_cost)
+            solver.minimize(t_mass)
+            solver.minimize(t_time)
+            for c, m, t in minimize_value or ():
+                solver.add(Or(t_cost < c, t_mass < m, t_time < t))
+            return None
+        target = None
         if minimize == "time":
             solver.minimize(t_time)
             solver.minimize(t_cost)
             solver.minimize(t_load)
-            if minimize_value is not None:
-                solver.add(t_time <= minimize_value)
+            target = t_time
         elif minimize == "mass":
             solver.minimize(t_load)
             solver.minimize(t_cost)
             solver.minimize(t_time)
-            if minimize_value is not None:
-                solver.add(t_load <= minimize_value)
+            target = t_load - self.load # missions report their mass without the payload
         elif minimize == "cost":
             solver.minimize(t_cost)
             solver.minimize(t_time)
             solver.minimize(t_load)
-            if minimize_value is not None:
-                solver.add(t_cost <= minimize_value)
-        if self.year:
-            solver.minimize(a_year[0]) # prefer the soonest arrival date
-            solver.maximize(a_year[len(route)-1]) # and latest start date
+            target = t_cost
+        if target is not None and minimize_value is not None:
+            solver.add(target <= minimize_value)
+        if self.year and last_time is not None:
+            # without slingshots the mission starts in the starting year (see _years), so the
+            # soonest arrival date is the one with the least time before the last maneuver
+            solver.minimize(t_time - last_time)
+        elif self.year:
+            index = index or (lambda i: i)
+            solver.minimize(Int("year__{}".format(index(0)))) # prefer the soonest arrival date
+            solver.maximize(Int("year__{}".format(index(n-1)))) # and latest start date
+        return target
+
+    """
+    The assignment that z3 starts from on the (reversed) route: the stages of the hint given to
+    plan() for the maneuvers that the route ends with as well, or the greedy assignment if the
+    planner has hints. None if there is neither.
+    """
+    def _start_from(self, route, minimize):
+        if self._hint:
+            assignment = _assignment(route, self._hint)
+            if len(assignment) > 1:
+                return assignment
+        if self.hints:
+            return greedy(self, route, self._find_ion_detach_maneuvers(route), minimize)
+        return None
+
+    """
+    Start z3 from the assignment for the (reversed) route. If z3 quickly finds a solution with its
+    values, target (from _finish) is bounded by the value of that solution, which the best one can
+    not be worse than. Otherwise its values are given to z3 as initial values. (z3 does worse when
+    it also gets the values of a solution it is bounded by.) index is as in _finish.
+    """
+    def _warm_start(self, solver, route, minimize, target, index=None):
+        from z3 import Int, Solver, sat
+        assignment = self._start_from(route, minimize)
+        if not assignment:
+            return
+        index = index or (lambda i: i)
+        values = []
+        for key, value in assignment.items():
+            if key != "ion":
+                kind, i = key.split("__")
+                key = "{}__{}".format(kind, index(int(i)))
+            values.append((Int(key), value))
+        if target is not None:
+            check = Solver()
+            left = self._time_left()
+            check.set("timeout", int(1000*(HINT_TIMEOUT if left is None else max(min(left, HINT_TIMEOUT), 0.001))))
+            check.add(*solver.assertions())
+            check.add(*(variable == value for variable, value in values))
+            with self._timer("hint"):
+                result = check.check()
+            if result == sat:
+                bound = check.model().eval(target, model_completion=True).as_long()
+                log.debug("Starting from a solution with value {}".format(bound))
+                solver.add(target <= bound)
+                if self.stats is not None:
+                    self.stats.set(hint=bound)
+                return
+        for variable, value in values:
+            solver.set_initial_value(variable, value)
 
+    """
+    Time a phase of planning if the planner has stats.
+    """
+    def _timer(self, name):
+        return self.stats.timer(name) if self.stats is not None else nullcontext()
+
+    """
+    The seconds that z3 may still spend on a route, or None if there is no limit.
+    """
+    def _time_left(self):
+        left = self.timeout
+        if self.deadline is not None:
+            remaining = max(self.deadline - clock.time(), 0)
+            left = remaining if left is None else min(left, remaining)
+        return left
+
+    """
+    Solve the model. If z3 runs out of time (or is interrupted), the best solution it found so far
+    is returned, if any, and the planner is marked as interrupted.
+    """
+    def _check(self, solver, minimize_value=None):
+        from z3 import unsat, unknown, is_true, Z3Exception
         log.debug("Attempting to find a solution with target {} ...".format(minimize_value))
-        if solver.check() == unsat:
+        left = self._time_left()
+        solver.set("timeout", 4294967295 if left is None else max(int(left*1000), 1))
+        solver.set("ctrl_c", False) # Ctrl-C is left to the caller, which can cancel the search
+        with self._timer("check"):
+            result = solver.check()
+        if self.stats is not None:
+            self.stats.solver(solver, result)
+        if result == unsat:
             log.debug("No solution found")
-            return None, None
+            return None
+        if result == unknown:
+            self.interrupted = True
+            log.warning("Solver stopped early: {}".format(solver.reason_unknown()))
+            try:
+                model = solver.model()
+                if not all(is_true(model.eval(a, model_completion=True)) for a in solver.assertions()):
+                    return None
+            except Z3Exception:
+                return None
+            # variables missing from the model are 0, as they are in the completion checked above
+            log.debug("Using the best solution so far")
         else:
-            log.debug("Found solution {}".format(solver.model()))
-            return solver.model(), ion_detach_maneuvers
+            model = solver.model()
+            log.debug("Found solution {}".format(model))
+        return {key.name(): model[key].as_long() for key in model}
 
-    def plan(self, route, minimize=None, minimize_value=None, slingshot=False):
+    """
+    Build the z3 model of the (reversed) route. Returns the solver and the maneuvers after which
+    ions are detached.
+    """
+    def _encode(self, route, minimize=None, minimize_value=None):
+        from z3 import Optimize
+        solver = Optimize()
+
+        ion_detach_maneuvers = self._find_ion_detach_maneuvers(route)
+        self._check_route(route)
+
+        ion, constraints, totals = self._start()
+        for constraint in constraints:
+            solver.add(constraint)
+
+        # the years only matter to slingshots, and are filled in after solving without them
+        years = not self.year or self._find_slingshot_maneuvers(route)
+        self._size(route, years)
+
+        # add rules for each maneuver (0 is the last maneuver in the route)
+        last_time = None
+        for i, maneuver in enumerate(route):
+            constraints, totals = self._stage(i, maneuver, ion, totals, maneuver in ion_detach_maneuvers, i == len(route) - 1, years=years)
+            solver.add(*constraints)
+            if i == 0 and not years:
+                last_time = totals[7]
+
+        solver.add(*self._schedules(route))
+        target = self._finish(solver, len(route), totals, minimize, minimize_value, last_time=last_time)
+        self._warm_start(solver, route, minimize, target)
+        return solver, ion_detach_maneuvers
+
+    """
+    Restrict the years of the slingshot maneuvers of the (reversed) route to the schedules of its
+    calendar, or to the years that some schedule uses for each of them if there are too many. index
+    is as in _finish.
+    """
+    def _schedules(self, route, index=None):
+        from z3 import Int, And, Or
+        if not self.year:
+            return []
+        calendar = route_calendar(self, route)
+        if not calendar.slingshots:
+            return []
+        index = index or (lambda i: i)
+        years = [Int("year__{}".format(index(i))) for i in calendar.slingshots]
+        if len(calendar.schedules) <= MAX_SCHEDULES:
+            return [Or(*(And(*(y == v for y, v in zip(years, schedule))) for schedule in calendar.schedules))]
+        return [Or(*(y == v for v in calendar.years[i])) for i, y in zip(calendar.slingshots, years)]
+
+    """
+    Add the years that the (reversed) route was encoded without to a model: the mission starts in
+    the starting year and every maneuver starts when the one before it ends.
+    """
+    def _years(self, route, model):
+        if not self.year or "year__0" in model:
+            return model
+        model = dict(model)
+        year = self.year
+        for i in reversed(range(len(route))):
+            model["year__{}".format(i)] = year
+            year += model.get("time__{}".format(i), 0)
+        return model
+
+    def _plan(self, route, minimize=None, minimize_value=None):
+        with self._timer("encode"):
+            solver, ion_detach_maneuvers = self._encode(route, minimize, minimize_value)
+        model = self._check(solver, minimize_value)
+        if model is None:
+            return None, None
+        return self._years(route, model), ion_detach_maneuvers
+
+    def plan(self, route, minimize=None, minimize_value=None, slingshot=False, hint=None):
+        self.interrupted = False
+        self._hint = hint
+        if self.stats is None:
+            return self._plan_cached(route, minimize, minimize_value)
+        self.stats.begin(route, minimize, minimize_value)
+        try:
+            mission = self._plan_cached(route, minimize, minimize_value)
+        except Exception as e:
+            self.stats.end(None, e)
+            raise
+        self.stats.end(mission)
+        return mission
+
+    def _plan_cached(self, route, minimize=None, minimize_value=None):
+        if self.cache is None:
+            return self._mission(route, minimize, minimize_value)
+        key = self.cache.key(self, route, minimize, minimize_value)
+        found, mission = self.cache.get(key, self.graph)
+        if found:
+            log.debug("Found {} in the mission cache".format(route))
+            if self.stats is not None:
+                self.stats.set(engine="cache")
+            return mission
+        mission = self._mission(route, minimize, minimize_value)
+        if not self.interrupted: # the mission may not be the best one
+            self.cache.put(key, mission, self.graph)
+        return mission
+
+    """
+    Return the missions on the route that are Pareto-optimal in cost, mass and time, and better
+    than every (cost, mass, time) in front in at least one of them. z3 finds them one after the
+    other on the same solver.
+    """
+    def pareto(self, route, front=()):
+        self._check_route(route)
+        if self.stats is not None:
+            self.stats.begin(route, "pareto", list(front))
+            self.stats.set(engine="z3")
+        self.interrupted = False
+        self._hint = None
+        route = list(reversed(route))
+        with self._timer("encode"):
+            solver, ion_detach_maneuvers = self._encode(route, "pareto", list(front))
+        missions = []
+        while not self.interrupted:
+            model = self._check(solver)
+            if model is None:
+                break
+            with self._timer("decode"):
+                mission = self._decode(route, self._years(route, model), ion_detach_maneuvers)
+            # a model from an interrupted check need not be a new Pareto-optimal one
+            point = (mission["cost"], mission["mass"], mission["time"])
+            if not any(all(a <= b for a, b in zip((m["cost"], m["mass"], m["time"]), point)) for m in missions):
+                missions.append(mission)
+        if self.stats is not None:
+            self.stats.end(missions[0] if missions else None)
+        return missions
+
+    """
+    A lower bound on mission[minimize] for any mission on the route, or inf if the route can not
+    be flown. Routes whose bound is worse than a mission that has been found can be skipped.
+    """
+    def lower_bound(self, route, minimize):
+        route = list(reversed(route))
+        bound = allocator.lower_bound(self, route, self._find_ion_detach_maneuvers(route), minimize)
+        return bound - self.load if minimize == "mass" else bound
+
+    """
+    Return the totals that the optimization targets are compared on for a solution, followed by
+    the year of the last maneuver and the (negated) starting year if there is a starting year.
+    """
+    def _objective(self, route, assignment, minimize):
+        t_cost = cost(ion=assignment.get("ion", 0), free_ions=self.free_ions)
+        t_load = self.load
+        t_time = 0
+        for i in range(len(route)):
+            rockets = {k: assignment.get("{}__{}".format(k, i), 0) for k in allocator.ROCKETS}
+            t_cost += cost(**rockets)
+            t_load += mass(**rockets)
+            t_time += assignment.get("time__{}".format(i), 0)
+        value = allocator.objective(minimize, t_cost, t_load, t_time)
+        if self.year:
+            value += (assignment["year__0"], -assignment["year__{}".format(len(route)-1)])
+        return value
+
+    """
+    Solve the (reversed) route with the dynamic programming allocator when it applies and the
+    engine allows it, otherwise with z3. The "check" engine solves with both and fails if they
+    disagree on the optimum, unless z3 stops early.
+    """
+    def _solve(self, route, minimize=None, minimize_value=None):
+        if self.year and not route_calendar(self, route).schedules:
+            log.debug("No slingshot schedule fits the time")
+            return None, None
+        if self.engine == "z3" or not allocator.applies(self, route):
+            if self.engine == "dp":
+                raise Exception("The dp engine can not plan with minimum component counts, a minimum cost, or a starting year together with a minimum time.")
+            if self.stats is not None:
+                self.stats.set(engine="z3")
+            return self._plan(route, minimize, minimize_value)
+
+        self._check_route(route)
+        ion_detach_maneuvers = self._find_ion_detach_maneuvers(route)
+        log.debug("Allocating rockets without z3")
+        if self.stats is not None:
+            self.stats.set(engine="dp")
+        with self._timer("allocate"):
+            assignment = allocator.allocate(self, route, ion_detach_maneuvers, minimize, minimize_value)
+        if assignment is allocator.UNDECIDED:
+            if self.engine == "dp":
+                raise Exception("The dp engine could not keep to the component limits on {}.".format(list(reversed(route))))
+            log.debug("Falling back to z3")
+            if self.stats is not None:
+                self.stats.set(engine="z3")
+            return self._plan(route, minimize, minimize_value)
+        if self.engine == "check":
+            expected, _ = self._plan(route, minimize, minimize_value)
+            if self.interrupted: # z3 stopped early, so its solution need not be the optimum
+                log.warning("Could not check the allocator on {}: z3 stopped early".format(list(reversed(route))))
+            elif (expected is None) != (assignment is None) or (expected is not None and
+                    self._objective(route, expected, minimize) != self._objective(route, assignment, minimize)):
+                raise Exception("Allocator and z3 disagree on {}: {} != {}".format(list(reversed(route)), assignment, expected))
+        if assignment is None:
+            return None, None
+        return assignment, ion_detach_maneuvers
+
+    def _mission(self, route, minimize=None, minimize_value=None):
         log.debug("Starting planner for {}".format(route))
         route = list(reversed(route))
-        model, ion_detach_maneuvers = self._plan(route, minimize, minimize_value)
+        model, ion_detach_maneuvers = self._solve(route, minimize, minimize_value)
         if model is None:
             return model
+        with self._timer("decode"):
+            return self._decode(route, model, ion_detach_maneuvers)
+
+    """
+    Build the mission dictionary for the (reversed) route from a solution.
+    """
+    def _decode(self, route, model, ion_detach_maneuvers):
         plan = []
         for maneuver in route:
             if self.aerobraking and maneuver.ab_diff is not None:
@@ -209,16 +620,13 @@ class Planner():
         t_time = 0
         mission = {}
         ions = 0
-        for key in model:
-            val = model[key].as_long()
-            key = key.name()
-
+        for key, val in sorted(model.items(), key=_variable_order):
             if key == "ion" and val > 0:
                 components[key] = val
             elif val > 0:
                 key, i = tuple(key.split("__"))
                 i = int(i)
-                if key == "year" and i == len(route):
+                if i >= len(route): # unconstrained links past the end of the route
                     continue
 
                 stage = plan[i]
@@ -259,4 +667,198 @@ class Planner():
         mission["cost"] = t_cost
         mission["time"] = t_time
         mission["plan"] = plan
+        if self.interrupted:
+            mission["optimal"] = False
         return mission
+
+"""
+A Planner that keeps one z3 Optimize alive between calls to plan().
+
+Routes are encoded from the last maneuver backwards, so routes that end with the same maneuvers
+(e.g. everything from Eo onward) share the start of their encoding. Each maneuver's constraints
+are added in their own solver scope and stay on the scope stack while the next route shares them;
+only the maneuvers that differ, the mission totals, the objectives and the minimize_value bound
+are pushed and popped for each route. The maneuvers depend on the load, so changing it (e.g. in
+a payload sweep) starts a new solver.
+"""
+class IncrementalPlanner(Planner):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._reset()
+
+    def _reset(self):
+        self._solver = None
+        self._ion = None
+        self._totals = None
+        self._stack = [] # (maneuver, detach, running totals) for every maneuver scope
+        self._tail = False
+        self._load = None # the load that the maneuver scopes were encoded for
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("_solver", "_ion", "_totals", "_stack", "_tail", "_load"):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    """
+    The solver for a route whose maneuvers are encoded in the order of keys ((maneuver, detach)
+    pairs), started with the planner's own constraints if need be, the number of maneuvers at the
+    start of keys whose scopes are kept from the previous route and the running totals after them.
+    The scopes of the other maneuvers and of the previous route's tail are popped. The maneuvers are encoded for a load
+    (None if they do not depend on it), so a different load starts a new solver.
+    """
+    def _share(self, keys, load):
+        from z3 import Optimize
+        if self._solver is not None and self._load != load:
+            log.debug("Encoding from scratch for a load of {}".format(load))
+            self._reset()
+        if self._solver is None:
+            self._solver = Optimize()
+            self._ion, constraints, totals = self._start()
+            for constraint in constraints:
+                self._solver.add(constraint)
+            self._totals = self._base(totals)
+            self._load = load
+        solver = self._solver
+
+        if self._tail:
+            solver.pop()
+            self._tail = False
+
+        shared = 0
+        while shared < min(len(keys), len(self._stack)) and self._stack[shared][:2] == keys[shared]:
+            shared += 1
+        log.debug("Reusing {} of {} maneuvers".format(shared, len(keys)))
+        while len(self._stack) > shared:
+            solver.pop()
+            self._stack.pop()
+        return solver, shared, self._stack[-1][2] if self._stack else self._totals
+
+    """
+    The running totals that the first maneuver scope starts from.
+    """
+    def _base(self, totals):
+        return totals
+
+    def _plan(self, route, minimize=None, minimize_value=None):
+        from z3 import Int
+        ion_detach_maneuvers = self._find_ion_detach_maneuvers(route)
+        self._check_route(route)
+
+        # keep the maneuvers this route shares with the previous one
+        keys = [(maneuver, maneuver in ion_detach_maneuvers) for maneuver in route]
+        solver, shared, totals = self._share(keys, self.load)
+        self._size(route)
+        with self._timer("encode"):
+            for i in range(shared, len(route)):
+                maneuver, detach = keys[i]
+                solver.push()
+                constraints, totals = self._stage(i, maneuver, self._ion, totals, detach)
+                solver.add(*constraints)
+                self._stack.append((maneuver, detach, totals))
+
+            solver.push()
+            self._tail = True
+            if self.year:
+                solver.add(Int("year__{}".format(len(route)-1))>=self.year)
+                solver.add(*self._schedules(route))
+            target = self._finish(solver, len(route), totals, minimize, minimize_value)
+            self._warm_start(solver, route, minimize, target)
+        model = self._check(solver, minimize_value)
+        if model is None:
+            return None, None
+        return model, ion_detach_maneuvers
+
+"""
+A Planner that keeps one z3 Optimize alive between calls to plan() like IncrementalPlanner, but
+encodes routes from the first maneuver onwards, so that routes that start the same way (e.g.
+E -> Eso -> Eo for every destination from Earth) share the start of their encoding.
+
+The rockets of a maneuver have to lift everything after it, so the load of maneuver k (counted
+from the start of the route) is a variable, load__fk, which is tied to the load of maneuver k+1
+when that is added and to the payload in the route's own scope. The shared maneuvers therefore
+do not depend on the payload either, and the planner can plan for several payloads by changing
+load between calls. The variables are named by their position from the start (juno__f0, ...)
+and renamed to the usual ones before the mission is built.
+"""
+class PrefixPlanner(IncrementalPlanner):
+    """
+    The maneuvers are shared between payloads, so the rockets are not bounded by the load: None.
+    """
+    def _load_bound(self):
+        return None
+
+    def _base(self, totals):
+        return totals[:5] + (0,) + totals[6:] # the payload is added at the end
+
+    def _plan(self, route, minimize=None, minimize_value=None):
+        from z3 import Int
+        ion_detach_maneuvers = self._find_ion_detach_maneuvers(route)
+        self._check_route(route)
+
+        # keep the maneuvers this route starts with as well as the previous one
+        n = len(route)
+        keys = [(maneuver, maneuver in ion_detach_maneuvers) for maneuver in reversed(route)]
+        solver, shared, totals = self._share(keys, None)
+        self._size(route)
+        with self._timer("encode"):
+            for k in range(shared, n):
+                maneuver, detach = keys[k]
+                solver.push()
+                load = Int("load__f{}".format(k))
+                # the link to the year of maneuver k+1 has no effect if the route ends here
+                constraints, totals = self._stage("f{}".format(k), maneuver, self._ion, totals, detach, k == 0, "f{}".format(k+1), load)
+                if k > 0:
+                    rockets = (Int("{}__f{}".format(rocket, k)) if cap else 0 for rocket, cap in zip(allocator.ROCKETS, self._caps(maneuver)))
+                    constraints.append(Int("load__f{}".format(k-1)) == load + mass(*rockets))
+                solver.add(*constraints)
+                self._stack.append((maneuver, detach, totals))
+
+            solver.push()
+            self._tail = True
+            solver.add(Int("load__f{}".format(n-1)) == self.load)
+            index = lambda i: "f{}".format(n-1-i)
+            solver.add(*self._schedules(route, index))
+            totals = totals[:5] + (totals[5] + self.load,) + totals[6:]
+            target = self._finish(solver, n, totals, minimize, minimize_value, index)
+            self._warm_start(solver, route, minimize, target, index)
+        model = self._check(solver, minimize_value)
+        if model is None:
+            return None, None
+        return _renumber(model, n), ion_detach_maneuvers
+
+"""
+The assignment of the stages of a mission (as plan() returns them) to the maneuvers that the
+(reversed) route ends with as well, e.g. the best mission on an earlier route to the same place.
+"""
+def _assignment(route, mission):
+    plan = list(reversed(mission["plan"]))
+    assignment = {"ion": mission["components"].get("ion", 0)}
+    for i, maneuver in enumerate(route):
+        if i >= len(plan) or (plan[i]["origin"], plan[i]["destination"]) != (maneuver.src.name, maneuver.dst.name):
+            break
+        for rocket in allocator.ROCKETS:
+            assignment["{}__{}".format(rocket, i)] = plan[i]["components"].get(rocket, 0)
+        assignment["time__{}".format(i)] = plan[i].get("time", 0)
+        if "year" in plan[i]:
+            assignment["year__{}".format(i)] = plan[i]["year"]
+    return assignment
+
+"""
+Name the variables of a PrefixPlanner model for a route of length n like those of Planner._plan.
+"""
+def _renumber(model, n):
+    renumbered = {}
+    for key, val in model.items():
+        if key == "ion":
+            renumbered[key] = val
+            continue
+        kind, k = key.split("__")
+        k = int(k[1:])
+        if kind != "load" and k < n:
+            renumbered["{}__{}".format(kind, n-1-k)] = val
+    return renumbered
@@ -1,14 +1,19 @@
-Locations = {}
-JUPITER_SLINGSHOT = range(1956, 1986, 2)
-SATURN_SLINGSHOT = range(1957, 1986, 3)
-URANUS_SLINGSHOT = range(1957, 1986, 5)
-NEPTUNE_SLINGSHOT = range(1958, 1986, 6)
+from .graph import Graph
+import json
+import os
+
+DEFAULT_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps", "default.json")
+MAP_FIELDS = {"name", "single_stage", "slingshots", "locations", "maneuvers"}
+MANEUVER_FIELDS = {"origin", "destination", "difficulty", "time", "aerobraking", "slingshot"}
 
 class _Location:
+    __slots__ = ("name", "code", "maneuvers", "destinations")
+
     def __init__(self, name, code):
         self.name = name
         self.code = code
         self.maneuvers = []
+        self.destinations = {}
 
     def __str__(self):
         return self.name
@@ -19,14 +24,15 @@ class _Location:
     def connect(self, dst, diff, time=False, ab_diff=None, ab_time=None, slingshot=None):
         maneuver = _Maneuver(self, dst, diff, time=time, ab_diff=ab_diff, ab_time=ab_time, slingshot=slingshot)
         self.maneuvers.append(maneuver)
+        self.destinations.setdefault(dst, maneuver)
         return maneuver
 
     def to(self, dst):
-        for m in self.maneuvers:
-            if m.dst == dst:
-                return m
+        return self.destinations.get(dst)
 
 class _Maneuver:
+    __slots__ = ("src", "dst", "diff", "time", "ab_diff", "ab_time", "slingshot")
+
     def __init__(self, src, dst, diff, time=False, ab_diff=None, ab_time=None, slingshot=None):
         self.src = src
         self.dst = dst
@@ -57,142 +63,121 @@ class _Maneuver:
         else:
             return "{}-({})->{}".format(self.src.code, self.diff, self.dst.code)
 
-def create_location(name, code):
-    l = _Location(name, code)
-    Locations[code] = l
+"""
+Build the Graph of a map, given as a dict:
 
-def connect_locations(l1, l2, diff, time=False, ab_diff=None, ab_time=False, slingshot=None):
-    l1 = Locations[l1]
-    l2 = Locations[l2]
-    maneuver = l1.connect(l2, diff, time=time, ab_diff=ab_diff, ab_time=ab_time, slingshot=slingshot)
-    return maneuver
-
-create_location("Earth", "E")
-create_location("Suborbital flight", "Eso")
-create_location("Earth orbit", "Eo")
-create_location("Lunar orbit", "Lo")
-create_location("Lunar fly-by", "Lfb")
-create_location("Moon", "L")
-create_location("Inner planets transfer", "ipt")
-create_location("Venus fly-by", "Vfb")
-create_location("Venus orbit", "Vo")
-create_location("Venus", "V")
-create_location("Ceres", "C")
-create_location("Mars fly-by", "Mfb")
-create_location("Mars orbit", "Mo")
-create_location("Mars", "M")
-create_location("Phobos", "P")
-create_location("Mercury fly-by", "Hfb")
-create_location("Mercury orbit", "Ho")
-create_location("Mercury", "H")
-create_location("Earth cycler", "Ec")
-create_location("Mars cycler", "Mc")
-create_location("Outer planets transfer", "opt")
-create_location("Jupiter orbit", "Jo")
-create_location("Jupiter fly-by", "Jfb")
-create_location("Ganymede", "G")
-create_location("Ganymede orbit", "Go")
-create_location("Io", "I")
-create_location("Europa", "W")
-create_location("Callisto", "K")
-create_location("Saturn orbit", "So")
-create_location("Saturn fly-by", "Sfb")
-create_location("Titan", "T")
-create_location("Titan orbit", "To")
-create_location("Enceladus", "D")
-create_location("Uranus fly-by", "Ufb")
-create_location("Neptune fly-by", "Nfb")
+    locations    [{"code": ..., "name": ...}, ...] in order, with unique codes and names
+    maneuvers    [{"origin": code, "destination": code, "difficulty": ..., "time": ...}, ...], where
+                 time is left out if the maneuver can not take time, "aerobraking" is
+                 {"difficulty": ..., "time": ...} if aerobraking changes it and "slingshot" is the
+                 list of years it can be flown in, or the name of one of the lists in slingshots
+    slingshots   (optional) named lists of years
+    single_stage (optional) the codes of a launch, e.g. ["E", "Eso", "Eo"], whose two maneuvers
+                 can also be flown as the one maneuver from the first location to the last
+    name         (optional) the name of the map
+
+Maps with the same name, locations and maneuvers give the same Graph object, so that they share its
+indexes and caches.
+"""
+def parse_map(data):
+    if not isinstance(data, dict):
+        raise Exception("A map must be an object.")
+    unknown = set(data) - MAP_FIELDS
+    if unknown:
+        raise Exception("Unknown map fields {}.".format(", ".join(sorted(unknown))))
+    locations = {}
+    names = set() # missions refer to locations by name
+    for location in data.get("locations", ()):
+        for key in ("code", "name"):
+            if key not in location:
+                raise Exception("A location is missing its {}.".format(key))
+        if location["code"] in locations:
+            raise Exception("Location {} is defined twice.".format(location["code"]))
+        if location["name"] in names:
+            raise Exception("Location name {} is used twice.".format(location["name"]))
+        names.add(location["name"])
+        locations[location["code"]] = _Location(location["name"], location["code"])
+    slingshots = data.get("slingshots", {})
+    for maneuver in data.get("maneuvers", ()):
+        unknown = set(maneuver) - MANEUVER_FIELDS
+        if unknown:
+            raise Exception("Unknown maneuver fields {}.".format(", ".join(sorted(unknown))))
+        for key in ("origin", "destination", "difficulty"):
+            if key not in maneuver:
+                raise Exception("A maneuver is missing its {}.".format(key))
+        for key in ("origin", "destination"):
+            if maneuver[key] not in locations:
+                raise Exception("Unknown location {}.".format(maneuver[key]))
+        slingshot = maneuver.get("slingshot")
+        if isinstance(slingshot, str):
+            if slingshot not in slingshots:
+                raise Exception("Unknown slingshot {}.".format(slingshot))
+            slingshot = slingshots[slingshot]
+        aerobraking = maneuver.get("aerobraking", {})
+        locations[maneuver["origin"]].connect(locations[maneuver["destination"]], maneuver["difficulty"],
+                                              time=maneuver.get("time", False), ab_diff=aerobraking.get("difficulty"),
+                                              ab_time=aerobraking.get("time", False),
+                                              slingshot=None if slingshot is None else tuple(slingshot))
+    for location in locations.values():
+        location.maneuvers = tuple(location.maneuvers)
+    graph = Graph(locations, data.get("single_stage"), data.get("name"))
+    return _graphs.setdefault(graph.key, graph)
+
+_graphs = {} # by key
+_maps = {} # by path: (modification time and size, graph)
+
+"""
+The Graph of the map in a JSON file, or a TOML file (by its extension, with Python 3.11 or
+later). A file is only read again when it changes.
+"""
+def load_map(path):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    if path in _maps and _maps[path][0] == stamp:
+        return _maps[path][1]
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            raise Exception("Reading TOML maps needs Python 3.11 or later.")
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    else:
+        with open(path) as f:
+            data = json.load(f)
+    graph = parse_map(data)
+    _maps[path] = (stamp, graph)
+    return graph
+
+DEFAULT_GRAPH = load_map(DEFAULT_MAP)
+Locations = dict(DEFAULT_GRAPH.codes)
 
 # sub orbital connections
-EEo   = connect_locations("E",   "Eo",  8)
-EEso  = connect_locations("E",   "Eso", 3)
-EsoE  = connect_locations("Eso", "E",   0)
-EsoEo = connect_locations("Eso", "Eo",  5)
-
-connect_locations("C",   "ipt",  5, time=2)
-connect_locations("C",   "opt",  3, time=1)
-connect_locations("Ec",  "Eo",   3, time=0, ab_diff=0)
-connect_locations("Ec",  "Mc",   0, time=3)
-connect_locations("Eo",  "E",    0)
-connect_locations("Eo",  "Ec",   3, time=0)
-connect_locations("Eo",  "Lfb",  1, time=0)
-connect_locations("Eo",  "Lo",   3, time=0)
-connect_locations("Eo",  "Mfb",  3, time=3)
-connect_locations("Eo",  "Mo",   5, time=3)
-connect_locations("Eo",  "ipt",  3, time=1)
-connect_locations("Eo",  "opt",  6, time=1)
-connect_locations("H",   "Ho",   2)
-connect_locations("Hfb", "H",    4)
-connect_locations("Hfb", "Ho",   2, time=0)
-connect_locations("Ho",  "H",    2)
-connect_locations("Ho",  "ipt",  7, time=1)
-connect_locations("L",   "Lo",   2)
-connect_locations("Lfb", "Eo",   1, time=0)
-connect_locations("Lfb", "L",    4)
-connect_locations("Lfb", "Lo",   2, time=0)
-connect_locations("Lo",  "Eo",   3, time=0)
-connect_locations("Lo",  "L",    2)
-connect_locations("M",   "Mo",   3)
-connect_locations("Mc",  "Ec",   0, time=3)
-connect_locations("Mc",  "M",    3)
-connect_locations("Mc",  "Mo",   3, time=0, ab_diff=0)
-connect_locations("Mfb", "M",    3)
-connect_locations("Mfb", "Mo",   3, time=0, ab_diff=1)
-connect_locations("Mfb", "ipt",  1, time=2)
-connect_locations("Mfb", "Jfb",  4, time=3, slingshot=JUPITER_SLINGSHOT)
-connect_locations("Mo",  "Eo",   5, time=3)
-connect_locations("Mo",  "M",    0)
-connect_locations("Mo",  "Mc",   3, time=0)
-connect_locations("Mo",  "P",    1, time=0)
-connect_locations("Mo",  "ipt",  4, time=2)
-connect_locations("Mo",  "opt",  5, time=1)
-connect_locations("P",   "Mo",   1, time=0)
-connect_locations("V",   "Vo",   6)
-connect_locations("Vfb", "V",    1)
-connect_locations("Vfb", "Vo",   1, time=0, ab_diff=0)
-connect_locations("Vfb", "ipt",  1, time=3)
-connect_locations("Vfb", "Jfb",  1, time=1, slingshot=JUPITER_SLINGSHOT)
-connect_locations("Vo",  "V",    0)
-connect_locations("Vo",  "ipt",  3, time=1)
-connect_locations("Vo",  "opt",  9, time=1)
-connect_locations("ipt", "C",    5, time=1)
-connect_locations("ipt", "Eo",   3, time=1)
-connect_locations("ipt", "Hfb",  5, time=1)
-connect_locations("ipt", "Mfb",  1, time=2)
-connect_locations("ipt", "Mo",   4, time=2)
-connect_locations("ipt", "Vfb",  2, time=1)
-connect_locations("ipt", "Vo",   3, time=1)
-connect_locations("opt", "C",    3, time=1)
-connect_locations("opt", "Mo",   5, time=1, ab_diff=2, ab_time=1)
-connect_locations("opt", "Jfb",  4, time=2, slingshot=JUPITER_SLINGSHOT)
-connect_locations("opt", "Sfb",  3, time=3, slingshot=SATURN_SLINGSHOT)
-connect_locations("opt", "Ufb",  4, time=9, slingshot=URANUS_SLINGSHOT)
-connect_locations("opt", "Eo",   6, time=1, ab_diff=1, ab_time=1)
-connect_locations("Jfb", "Jo",  10, time=0, ab_diff=3)
-connect_locations("Jfb", "Sfb",  0, time=2, slingshot=SATURN_SLINGSHOT)
-connect_locations("Jfb", "opt",  4, time=2)
-connect_locations("G",   "Go",   2)
-connect_locations("I",   "Jo",   2, time=0)
-connect_locations("Go",  "G",    2)
-connect_locations("Go",  "Jo",   2, time=0)
-connect_locations("Jo",  "Jfb", 10, time=0)
-connect_locations("Jo",  "I",    2, time=0)
-connect_locations("Jo",  "Go",   3, time=0)
-connect_locations("Jo",  "W",    2, time=0)
-connect_locations("Jo",  "K",    5, time=0)
-connect_locations("Sfb", "Ufb",  0, time=5, slingshot=URANUS_SLINGSHOT)
-connect_locations("Sfb", "So",   7, time=0, ab_diff=1)
-connect_locations("Sfb", "opt",  3, time=3)
-connect_locations("To",  "So",   2, time=0)
-connect_locations("To",  "T",    0)
-connect_locations("T",   "To",   2)
-connect_locations("W",   "Jo",   2, time=0)
-connect_locations("K",   "Jo",   5, time=0)
-connect_locations("K",   "Jfb",  5)
-connect_locations("So",  "Sfb",  7, time=0)
-connect_locations("So",  "To",   2, time=0, ab_diff=1)
-connect_locations("So",  "T",    1)
-connect_locations("So",  "D",    2, time=0)
-connect_locations("D",   "So",   2, time=0)
-connect_locations("Ufb", "Nfb",  0, time=4, slingshot=NEPTUNE_SLINGSHOT)
-connect_locations("Ufb", "opt",  4, time=9)
+EEo   = Locations["E"].to(Locations["Eo"])
+EEso  = Locations["E"].to(Locations["Eso"])
+EsoE  = Locations["Eso"].to(Locations["E"])
+EsoEo = Locations["Eso"].to(Locations["Eo"])
+
+# the slingshot years of the default map
+JUPITER_SLINGSHOT = Locations["opt"].to(Locations["Jfb"]).slingshot
+SATURN_SLINGSHOT  = Locations["opt"].to(Locations["Sfb"]).slingshot
+URANUS_SLINGSHOT  = Locations["opt"].to(Locations["Ufb"]).slingshot
+NEPTUNE_SLINGSHOT = Locations["Ufb"].to(Locations["Nfb"]).slingshot
+
+"""
+Removed: locations and maneuvers can no longer be added to the default graph, which is built from
+its map. Add them to a map and build a graph from it instead, e.g. from the game's map:
+
+    data = DEFAULT_GRAPH.to_map()
+    data["locations"].append({"code": "X", "name": "Planet X"})
+    data["maneuvers"].append({"origin": "Nfb", "destination": "X", "difficulty": 4, "time": 5})
+    graph = parse_map(data)
+
+and pass graph to Planner and find_best_paths.
+"""
+def create_location(name, code):
+    raise Exception("create_location has been removed: add {{\"code\": \"{}\", \"name\": \"{}\"}} to the locations of a map, e.g. DEFAULT_GRAPH.to_map(), and build its graph with parse_map.".format(code, name))
+
+def connect_locations(l1, l2, diff, time=False, ab_diff=None, ab_time=False, slingshot=None):
+    raise Exception("connect_locations has been removed: add the maneuver from {} to {} to the maneuvers of a map, e.g. DEFAULT_GRAPH.to_map(), and build its graph with parse_map.".format(l1, l2))
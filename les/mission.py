@@ -0,0 +1,230 @@
+from .location import DEFAULT_GRAPH
+import struct
+
+ROCKETS = ("juno", "atlas", "soyuz", "proton", "saturn")
+COMPONENTS = ROCKETS + ("ion",)
+
+# stage flags
+AEROBRAKING = 1
+SLINGSHOT = 2
+TIMED = 4
+DATED = 8
+RENDEZVOUS = 16
+
+# mission flags
+YEARS = 1
+OPTIMAL = 2
+OPTIMAL_VALUE = 4
+
+"""
+One maneuver of a mission. origin and destination are location codes and components the number
+of each rocket and of ion thrusters (in COMPONENTS order) used by it. time and year are None when
+the mission dict leaves them out, and detach is the number of ion thrusters left behind after
+the maneuver, if any.
+"""
+class Stage():
+    __slots__ = ("origin", "destination", "difficulty", "components", "aerobraking", "time", "year", "detach", "thrust", "slingshot")
+
+    def __init__(self, origin, destination, difficulty, components, aerobraking=False, time=None, year=None, detach=None, thrust=0, slingshot=False):
+        self.origin = origin
+        self.destination = destination
+        self.difficulty = difficulty
+        self.components = tuple(components)
+        self.aerobraking = aerobraking
+        self.time = time
+        self.year = year
+        self.detach = detach
+        self.thrust = thrust
+        self.slingshot = slingshot
+
+    def __eq__(self, other):
+        return isinstance(other, Stage) and all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    @classmethod
+    def from_dict(cls, stage, codes):
+        components = stage["components"]
+        unknown = set(components) - set(COMPONENTS)
+        if unknown:
+            raise Exception("Unknown components {}.".format(", ".join(sorted(unknown))))
+        detach = None
+        if "rendezvous" in stage:
+            rendezvous = stage["rendezvous"]
+            if len(rendezvous) != 1 or list(rendezvous[0]) != ["detach"] or rendezvous[0]["detach"][0] != "ion":
+                raise Exception("Unsupported rendezvous {}.".format(rendezvous))
+            detach = rendezvous[0]["detach"][1]
+        return cls(codes[stage["origin"]], codes[stage["destination"]], stage["difficulty"],
+                   (components.get(k, 0) for k in COMPONENTS), stage["aerobraking"], stage.get("time"),
+                   stage.get("year"), detach, stage["thrust"], stage["slingshot"])
+
+    def to_dict(self, names):
+        stage = {"origin": names[self.origin], "destination": names[self.destination], "difficulty": self.difficulty,
+                 "components": {k: n for k, n in zip(COMPONENTS, self.components) if n},
+                 "aerobraking": self.aerobraking}
+        if self.time is not None:
+            stage["time"] = self.time
+        if self.year is not None:
+            stage["year"] = self.year
+        if self.detach is not None:
+            stage["rendezvous"] = [{"detach": ["ion", self.detach]}]
+        stage["thrust"] = self.thrust
+        stage["slingshot"] = self.slingshot
+        return stage
+
+"""
+A compact form of the mission dicts that Planner.plan returns, which converts back to the same
+dict (with the same key order) with to_dict(). components are the mission's totals in COMPONENTS
+order, start and end are None for missions without a starting year and optimal is None unless
+the mission dict says whether it is optimal.
+"""
+class Mission():
+    __slots__ = ("components", "payload", "mass", "cost", "time", "start", "end", "optimal", "stages")
+    FIELDS = {"start", "end", "components", "payload", "mass", "cost", "time", "plan", "optimal"}
+
+    def __init__(self, components, payload, mass, cost, time, stages, start=None, end=None, optimal=None):
+        self.components = tuple(components)
+        self.payload = payload
+        self.mass = mass
+        self.cost = cost
+        self.time = time
+        self.start = start
+        self.end = end
+        self.optimal = optimal
+        self.stages = tuple(stages)
+
+    def __eq__(self, other):
+        return isinstance(other, Mission) and all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    @classmethod
+    def from_dict(cls, mission, graph=DEFAULT_GRAPH):
+        unknown = set(mission) - cls.FIELDS
+        if unknown:
+            raise Exception("Unknown mission fields {}.".format(", ".join(sorted(unknown))))
+        codes, _ = _locations(graph)
+        components = mission["components"]
+        return cls((components.get(k, 0) for k in COMPONENTS), mission["payload"], mission["mass"], mission["cost"],
+                   mission["time"], (Stage.from_dict(stage, codes) for stage in mission["plan"]),
+                   mission.get("start"), mission.get("end"), mission.get("optimal"))
+
+    def to_dict(self, graph=DEFAULT_GRAPH):
+        _, names = _locations(graph)
+        mission = {}
+        if self.start is not None:
+            mission["start"] = self.start
+            mission["end"] = self.end
+        # the planner adds the rockets in the order they are first used from the end of the route
+        components = {}
+        for stage in reversed(self.stages):
+            for k, n in zip(ROCKETS, stage.components):
+                if n and k not in components:
+                    components[k] = self.components[COMPONENTS.index(k)]
+        for k, n in zip(COMPONENTS, self.components):
+            if n and k not in components:
+                components[k] = n
+        mission["components"] = components
+        mission["payload"] = self.payload
+        mission["mass"] = self.mass
+        mission["cost"] = self.cost
+        mission["time"] = self.time
+        mission["plan"] = [stage.to_dict(names) for stage in self.stages]
+        if self.optimal is not None:
+            mission["optimal"] = self.optimal
+        return mission
+
+_names = {}
+
+def _locations(graph):
+    if graph.key not in _names:
+        _names[graph.key] = ({l.name: l.code for l in graph.locations}, {l.code: l.name for l in graph.locations})
+    return _names[graph.key]
+
+"""
+The binary encoding of missions: a fixed-size record per mission followed by one per stage, with
+locations as their index in the graph.
+"""
+MISSION = struct.Struct("<6HIIIIhhBH")
+STAGE = struct.Struct("<HHB6HBHHHI")
+MAGIC = b"LESM2"
+
+"""
+Encode a mission (a Mission or a mission dict) in the binary format. Raises struct.error if a
+value does not fit in its field.
+"""
+def pack(mission, graph=DEFAULT_GRAPH):
+    if isinstance(mission, dict):
+        mission = Mission.from_dict(mission, graph)
+    ids = {l.code: i for l, i in graph.node_ids.items()}
+    flags = (YEARS if mission.start is not None else 0) | (OPTIMAL if mission.optimal is not None else 0) | (OPTIMAL_VALUE if mission.optimal else 0)
+    data = [MISSION.pack(*mission.components, mission.payload, mission.mass, mission.cost, mission.time,
+                         mission.start or 0, mission.end or 0, flags, len(mission.stages))]
+    for stage in mission.stages:
+        flags = ((AEROBRAKING if stage.aerobraking else 0) | (SLINGSHOT if stage.slingshot else 0) |
+                 (TIMED if stage.time is not None else 0) | (DATED if stage.year is not None else 0) |
+                 (RENDEZVOUS if stage.detach is not None else 0))
+        data.append(STAGE.pack(ids[stage.origin], ids[stage.destination], stage.difficulty, *stage.components, flags,
+                               stage.time or 0, stage.year or 0, stage.detach or 0, stage.thrust))
+    return b"".join(data)
+
+"""
+Decode a Mission from data at offset. Returns the mission and the offset after it.
+"""
+def unpack_from(data, offset=0, graph=DEFAULT_GRAPH):
+    *components, payload, mass, cost, time, start, end, flags, n = MISSION.unpack_from(data, offset)
+    offset += MISSION.size
+    stages = []
+    for _ in range(n):
+        src, dst, difficulty, *counts, stage_flags, stage_time, year, detach, thrust = STAGE.unpack_from(data, offset)
+        offset += STAGE.size
+        stages.append(Stage(graph.locations[src].code, graph.locations[dst].code, difficulty, counts,
+                            bool(stage_flags & AEROBRAKING), stage_time if stage_flags & TIMED else None,
+                            year if stage_flags & DATED else None, detach if stage_flags & RENDEZVOUS else None,
+                            thrust, bool(stage_flags & SLINGSHOT)))
+    years = flags & YEARS
+    optimal = bool(flags & OPTIMAL_VALUE) if flags & OPTIMAL else None
+    return Mission(components, payload, mass, cost, time, stages, start if years else None, end if years else None, optimal), offset
+
+def unpack(data, graph=DEFAULT_GRAPH):
+    mission, _ = unpack_from(data, 0, graph)
+    return mission
+
+"""
+Write missions to a binary file (opened with "wb") one at a time. The file starts with a header
+that ties it to the graph whose location indices it uses.
+"""
+class MissionWriter():
+    def __init__(self, f, graph=DEFAULT_GRAPH):
+        self.f = f
+        self.graph = graph
+        f.write(MAGIC + graph.key.encode())
+
+    def write(self, mission):
+        self.f.write(pack(mission, self.graph))
+
+"""
+Read the missions from a binary file written by MissionWriter, one at a time.
+"""
+def read_missions(f, graph=DEFAULT_GRAPH):
+    header = MAGIC + graph.key.encode()
+    buffer = b""
+    while len(buffer) < len(header):
+        chunk = f.read(len(header) - len(buffer))
+        if not chunk:
+            break
+        buffer += chunk
+    if buffer != header:
+        raise Exception("Not a mission file for this location graph.")
+    buffer = b""
+    while True:
+        chunk = f.read(65536)
+        buffer += chunk
+        offset = 0
+        while len(buffer) - offset >= MISSION.size:
+            n = MISSION.unpack_from(buffer, offset)[-1]
+            if len(buffer) - offset < MISSION.size + n*STAGE.size:
+                break
+            mission, offset = unpack_from(buffer, offset, graph)
+            yield mission
+        buffer = buffer[offset:]
+        if not chunk:
+            if buffer:
+                raise Exception("Truncated mission file.")
+            return
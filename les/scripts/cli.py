@@ -1,7 +1,12 @@
 import click
 from les import __version__
-from les import Planner, find_best_paths, Locations, DEFAULT_COMPONENT_MAX
+from les import Planner, IncrementalPlanner, find_best_paths, route_index, RouteIndex, load_map, DEFAULT_GRAPH, DEFAULT_COMPONENT_MAX
+from les.solve import plan_routes, pareto_routes, sweep_routes, Session, Cancellation, run_cancellable
+from les.cache import MissionCache, default_cache_path
+from les.stats import PlannerStats
 import re
+import sys
+import signal
 import json
 import logging
 log = logging.getLogger("les")
@@ -13,6 +18,10 @@ class Range(click.ParamType):
             return value
         if value is None:
             return None
+        if isinstance(value, list) and len(value) == 2: # from JSON queries
+            return tuple(sorted(value))
+        if isinstance(value, int):
+            value = str(value)
         m = re.match("^[0-9]*$", value) # exact number
         if m:
             value = int(value)
@@ -29,7 +38,7 @@ class Range(click.ParamType):
             value = int(value)
             return (value, 900)
 
-        m = re.match("^[0-9]-[0-9]*$", value) # range
+        m = re.match("^[0-9]+-[0-9]+$", value) # range
         if m:
             values = value.split("-")
             value1 = int(values[0])
@@ -45,17 +54,46 @@ class Range(click.ParamType):
             ctx,
         )
 
-def find_best(missions, minimize):
-    missions = [mission for mission in missions if mission]
-    if minimize == "time":
-        return sorted(missions, key=lambda x: x.get("time", 0))
-    if minimize == "cost":
-        return sorted(missions, key=lambda x: x.get("cost", 0))
-    if minimize == "mass":
-        return sorted(missions, key=lambda x: x.get("mass", 0))
+"""
+The map in a JSON or TOML file, as a Graph.
+"""
+class Map(click.ParamType):
+    name = "map"
+    def convert(self, value, param, ctx):
+        if value is None or not isinstance(value, str):
+            return value
+        try:
+            return load_map(value)
+        except Exception as e:
+            self.fail("Could not load the map {}: {}".format(value, e), param, ctx)
+
+"""
+A group that runs its default command when the first argument is not the name of a command, so
+that `les E Mo` is the same as `les plan E Mo`.
+"""
+class DefaultGroup(click.Group):
+    def __init__(self, *args, default_command=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] not in ("--help", "--version"):
+            args.insert(0, self.default_command)
+        return super().parse_args(ctx, args)
+
+ROUTES = click.Choice(["optimal","all"]+[str(i) for i in range(1,32)], case_sensitive=False)
+MINIMIZE = click.Choice(["time","cost","mass","pareto"], case_sensitive=False)
+ENGINE = click.Choice(["auto", "z3", "dp", "check"], case_sensitive=False)
+YEAR = click.IntRange(min=1956, max=1986)
 
-@click.command()
+@click.group(cls=DefaultGroup, default_command="plan")
 @click.version_option(__version__)
+def cli():
+    """
+    Plan Leaving Earth missions. Without a command, the arguments are passed to plan.
+    """
+
+@cli.command()
 @click.option("-v", "--verbose", is_flag=True, help="Verbose mode")
 @click.option("-j", "--juno", type=Range(), default="0-{}".format(DEFAULT_COMPONENT_MAX), help="Number of Juno rockets")
 @click.option("-a", "--atlas", type=Range(), default="0-{}".format(DEFAULT_COMPONENT_MAX), help="Number of Atlas rockets")
@@ -65,59 +103,208 @@ def find_best(missions, minimize):
 @click.option("-i", "--ion", type=Range(), default="0-{}".format(DEFAULT_COMPONENT_MAX), help="Number of Ion thrusters")
 @click.option("-c", "--cost", type=Range(), default=None, help="Cost of mission")
 @click.option("--free-ions", type=click.IntRange(min=0), default=0, help="Number of Ion thrusters available at the origin")
-@click.option("-m", "--minimize", type=click.Choice(["time","cost","mass"], case_sensitive=False), default="cost", help="Minimization goal")
-@click.option("--routes", type=click.Choice(["optimal","all"]+[str(i) for i in range(1,32)], case_sensitive=False), default="optimal", help="Which routes to try when there are multiple options")
+@click.option("-m", "--minimize", type=MINIMIZE, default="cost", help="Minimization goal (pareto lists every mission that is not beaten in cost, mass and time at once)")
+@click.option("--routes", type=ROUTES, default="optimal", help="Which routes to try when there are multiple options")
 @click.option("--single-stage", is_flag=True, help="Check a single stage configuration for launches from Earth (by default only a two-stage configuration will be attempted)")
 @click.option("--aerobraking/--no-aerobraking", is_flag=True, help="Use aerobraking")
 @click.option("--rendezvous/--no-rendezvous", default=True, help="If rendezvous technology is available, Ion thrusters will be detached when no longer needed")
+@click.option("--map", "graph", type=Map(), default=None, help="Plan on the map of locations and maneuvers in this JSON or TOML file instead of the game's")
 @click.argument("orig", required=True, metavar="ORIGIN")
 @click.argument("dest", required=True, metavar="DESTINATION")
 @click.argument("payload", type=click.IntRange(min=1, max=None), default=1)
+@click.option("--payload-sweep", type=Range(), default=None, help="Plan the best mission for every payload in this range (e.g. 1-10) instead of PAYLOAD")
 @click.option("-t", "--time", type=Range(), default=None, help="Number of time tokens")
-@click.option("-y", "--year", type=click.IntRange(min=1956, max=1986), default=None, help="Year that journey starts")
-def cli(verbose, juno, atlas, soyuz, proton, saturn, ion, cost, free_ions, minimize, routes, single_stage, aerobraking, rendezvous, orig, dest, payload, time, year):
+@click.option("-y", "--year", type=YEAR, default=None, help="Year that journey starts")
+@click.option("--jobs", type=click.IntRange(min=1), default=1, help="Number of processes used to plan routes in parallel")
+@click.option("--incremental", is_flag=True, help="Reuse one solver across routes, sharing the constraints of common final maneuvers")
+@click.option("--cache", "cache_path", type=click.Path(dir_okay=False), default=None, help="Cache solved missions in this file")
+@click.option("--use-cache", is_flag=True, help="Cache solved missions in {}".format(default_cache_path()))
+@click.option("--engine", type=ENGINE, default="auto", help="Rocket allocation engine (auto uses the exact allocator where it applies and z3 otherwise, check compares the two)")
+@click.option("--hints", is_flag=True, help="Start z3 from a greedy allocation of rockets, or from the best mission on an earlier route")
+@click.option("--profile", is_flag=True, help="Write timings and solver statistics for every route to stderr as JSON")
+@click.option("--timeout", type=click.FloatRange(min=0), default=None, help="Seconds to spend on the whole search; the best mission found by then is marked as not optimal")
+@click.option("--route-timeout", type=click.FloatRange(min=0), default=None, help="Seconds that z3 may spend on one route")
+def plan(verbose, juno, atlas, soyuz, proton, saturn, ion, cost, free_ions, minimize, routes, single_stage, aerobraking, rendezvous, graph, orig, dest, payload, payload_sweep, time, year, jobs, incremental, cache_path, use_cache, engine, hints, profile, timeout, route_timeout):
     """
+    Plan the best mission from ORIGIN to DESTINATION. With --payload-sweep, the result is a list
+    with the mission (or null) for every payload.
     """
     if verbose:
         logging.basicConfig(level=logging.DEBUG)
+    if payload_sweep is not None:
+        if payload_sweep[0] < 1:
+            log.error("Payloads must be at least 1.")
+            exit(1)
+        if minimize == "pareto":
+            log.error("A payload sweep can not be combined with pareto.")
+            exit(1)
 
+    graph = graph or DEFAULT_GRAPH
     try:
         if orig == dest:
             log.error("Origin and destination may not be the same.")
             exit(1)
-        orig = Locations[orig]
-        dest = Locations[dest]
+        orig = graph.codes[orig]
+        dest = graph.codes[dest]
     except KeyError as e:
         log.error("Error finding {}. Must be one of the following:".format(e))
-        for code, name in Locations.items():
+        for code, name in graph.codes.items():
             print(code.rjust(4), ": ", name, sep="")
         exit(1)
-    planner = Planner(load=payload, juno=juno, atlas=atlas, soyuz=soyuz, proton=proton, saturn=saturn, ion=ion, time=time, year=year, cost=cost, free_ions=free_ions, rendezvous=rendezvous, aerobraking=aerobraking)
-    paths = find_best_paths(orig, dest, path_filter=routes, single_stage=single_stage, aerobraking=aerobraking)
+    planner_class = IncrementalPlanner if incremental else Planner
+    planner = planner_class(load=payload, juno=juno, atlas=atlas, soyuz=soyuz, proton=proton, saturn=saturn, ion=ion, time=time, year=year, cost=cost, free_ions=free_ions, rendezvous=rendezvous, aerobraking=aerobraking, engine=engine, timeout=route_timeout, hints=hints, graph=graph)
+    if cache_path or use_cache:
+        planner.cache = MissionCache(cache_path)
+    if profile:
+        planner.stats = PlannerStats()
+        with planner.stats.timer("paths"):
+            paths = find_best_paths(orig, dest, path_filter=routes, single_stage=single_stage, aerobraking=aerobraking, graph=graph)
+    else:
+        paths = find_best_paths(orig, dest, path_filter=routes, single_stage=single_stage, aerobraking=aerobraking, graph=graph)
     log.info("Found {} paths using '{}' strategy".format(len(paths), routes))
 
-    missions = []
-    minimize_value = None
-    try:
-        for path in paths:
-            log.debug("Planning for {}".format(path))
-            mission = planner.plan(path, minimize=minimize, minimize_value=minimize_value, slingshot=year)
-            if mission:
-                new_mv = mission[minimize]
-                log.info("Found solution using {} with value {}".format(path, new_mv))
-                if minimize_value is None or new_mv < minimize_value:
-                    minimize_value = new_mv
-                missions.append(mission)
-            else:
-                log.info("Unable to find a solution using {}".format(path))
-    except Exception as e:
-        log.error(e)
-
-    missions = find_best(missions, minimize)
-    if missions:
-        print(json.dumps(missions[0], indent=4))
+    # Ctrl-C (or SIGTERM) stops the search and prints the best mission found so far
+    signal.signal(signal.SIGTERM, _interrupt)
+    cancel = Cancellation()
+    if payload_sweep is not None:
+        payloads = range(payload_sweep[0], payload_sweep[1] + 1)
+        missions = run_cancellable(lambda: sweep_routes(planner, paths, minimize, payloads, jobs=jobs, timeout=timeout, cancel=cancel), cancel)
+        mission = [{"payload": payload, "mission": missions[payload]} for payload in payloads]
+        if not any(missions.values()):
+            mission = None
+    elif minimize == "pareto":
+        mission = run_cancellable(lambda: pareto_routes(planner, paths, timeout=timeout, cancel=cancel), cancel)
+    else:
+        mission = run_cancellable(lambda: plan_routes(planner, paths, minimize, jobs=jobs, timeout=timeout, cancel=cancel), cancel)
+    if profile:
+        print(json.dumps(planner.stats.as_dict()), file=sys.stderr)
+    if mission:
+        print(json.dumps(mission, indent=4))
     else:
         exit(1)
 
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+QUERY_TYPES = {
+    "payload": click.IntRange(min=1),
+    "minimize": MINIMIZE,
+    "routes": ROUTES,
+    "single_stage": click.BOOL,
+    "juno": Range(),
+    "atlas": Range(),
+    "soyuz": Range(),
+    "proton": Range(),
+    "saturn": Range(),
+    "ion": Range(),
+    "cost": Range(),
+    "time": Range(),
+    "year": YEAR,
+    "free_ions": click.IntRange(min=0),
+    "rendezvous": click.BOOL,
+    "aerobraking": click.BOOL,
+    "engine": ENGINE,
+    "hints": click.BOOL,
+    "map": Map(),
+    "timeout": click.FloatRange(min=0),
+    "route_timeout": click.FloatRange(min=0),
+}
+
+"""
+Turn a JSON query into the arguments of Session.solve().
+"""
+def parse_query(query):
+    if not isinstance(query, dict):
+        raise Exception("Query must be a JSON object.")
+    options = {}
+    for key, value in query.items():
+        if key in ("id", "origin", "destination"):
+            continue
+        if key not in QUERY_TYPES:
+            raise Exception("Unknown query field {}.".format(key))
+        try:
+            options[key] = QUERY_TYPES[key].convert(value, None, None) if value is not None else None
+        except click.BadParameter as e:
+            raise Exception("Invalid {}: {}".format(key, e.message))
+    if "map" in options: # the planner's name for it
+        graph = options.pop("map")
+        if graph is not None:
+            options["graph"] = graph
+    for key in ("origin", "destination"):
+        if key not in query:
+            raise Exception("Query is missing {}.".format(key))
+    return query["origin"], query["destination"], options
+
+@cli.command()
+@click.option("-v", "--verbose", is_flag=True, help="Verbose mode")
+@click.option("--jobs", type=click.IntRange(min=1), default=1, help="Number of processes used to plan routes in parallel")
+@click.option("--cache", "cache_path", type=click.Path(dir_okay=False), default=None, help="Cache solved missions in this file")
+@click.option("--use-cache", is_flag=True, help="Cache solved missions in {}".format(default_cache_path()))
+@click.option("--profile", is_flag=True, help="Add timings and solver statistics for every route to each result")
+@click.option("--timeout", type=click.FloatRange(min=0), default=None, help="Seconds to spend on each query unless it sets its own timeout")
+@click.option("--route-timeout", type=click.FloatRange(min=0), default=None, help="Seconds that z3 may spend on one route unless the query sets its own route_timeout")
+@click.argument("queries", type=click.File("r"), default="-")
+def batch(verbose, jobs, cache_path, use_cache, profile, timeout, route_timeout, queries):
+    """
+    Plan a mission for every query in QUERIES (standard input by default), one JSON object per
+    line, e.g. {"id": 1, "origin": "E", "destination": "Mo", "payload": 2, "minimize": "time"}.
+    The other fields are the same as the options of plan, with ranges given as strings ("2-4"),
+    numbers or [min, max] lists.
+
+    Results are written as they are found, one JSON object per line with the query's id (or its
+    line number) and either its mission (null if there is none) or an error, plus its profile
+    with --profile. Missions found before a timeout have "optimal": false. With "minimize": "pareto"
+    the mission is a list of missions.
+
+    Ctrl-C (or SIGTERM) stops the current query, writes its result and ends the batch.
+    """
+    if verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    cache = MissionCache(cache_path) if cache_path or use_cache else None
+    session = Session(jobs=jobs, cache=cache)
+    signal.signal(signal.SIGTERM, _interrupt)
+    cancel = Cancellation()
+    for n, line in enumerate(queries, 1):
+        if cancel.cancelled():
+            break
+        if not line.strip():
+            continue
+        result = {"id": n}
+        try:
+            query = json.loads(line)
+            if isinstance(query, dict) and "id" in query:
+                result["id"] = query["id"]
+            orig, dest, options = parse_query(query)
+            options.setdefault("timeout", timeout)
+            options.setdefault("route_timeout", route_timeout)
+            stats = PlannerStats() if profile else None
+            mission, errors = run_cancellable(lambda: session.solve(orig, dest, stats=stats, cancel=cancel, **options), cancel)
+            result["mission"] = mission
+            if errors:
+                result["error"] = str(errors[0])
+            if stats is not None:
+                result["profile"] = stats.as_dict()
+        except Exception as e:
+            result["error"] = str(e)
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+@cli.command()
+@click.option("-v", "--verbose", is_flag=True, help="Verbose mode")
+@click.option("--map", "graph", type=Map(), default=None, help="Index the map of locations and maneuvers in this JSON or TOML file instead of the game's")
+def index(verbose, graph):
+    """
+    Build the route index of a map in the cache directory, so that later runs look the routes
+    between two locations up instead of searching for them.
+    """
+    if verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    graph = graph or DEFAULT_GRAPH
+    if len(graph.maneuvers) > RouteIndex.MAX_MANEUVERS:
+        log.error("A route index can not have more than {} maneuvers.".format(RouteIndex.MAX_MANEUVERS))
+        exit(1)
+    if not route_index(graph).build():
+        exit(1)
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,552 @@
+from collections import OrderedDict
+from functools import lru_cache
+from contextlib import nullcontext, contextmanager
+from math import inf
+import threading
+import signal
+import time as clock
+import sys
+from .location import DEFAULT_GRAPH
+from .les import IncrementalPlanner, PrefixPlanner
+from . import find_best_paths, find_campaign_paths
+import json
+import logging
+log = logging.getLogger("les")
+
+"""
+Plan every route and return the best mission, or None if no route has a solution.
+
+Each route is solved with the best value found so far as an upper bound, so later routes only
+succeed if they are at least as good. The winner is the first route (in the given order) that
+reaches the best value. Since the bound a route was solved with depends on which routes finished
+before it, the winner is re-planned without a bound unless it was already solved that way; this
+makes the mission independent of the order in which bounds were found, so running with jobs > 1
+gives exactly the same result as a serial run.
+
+With prune, every route first gets a cheap lower bound (Planner.lower_bound) and the routes are
+planned best bound first. A route is skipped without calling the solver when its bound shows
+that it can not win: it can not be flown at all, its bound is above the best value, or its bound
+equals the best value and an earlier route already reaches it. The number of skipped routes is
+logged and added to the planner's stats.
+
+A route that can not be planned (e.g. a slingshot without a starting year) stops the search: only
+the routes before it are considered and its exception is logged, or appended to errors if a list
+is given.
+
+If the planner has hints, z3 starts every route from the best mission found so far, on the
+maneuvers that the route ends with as well.
+
+route_bounds, if given, is a list of lower bounds on the value of each route that are already
+known (e.g. from a lighter payload), which are used along with Planner.lower_bound when pruning,
+and it is updated with what the search finds out: the value of every route that was solved, or
+one more than the bound it was shown to exceed. Routes are then tried in the order of these
+bounds, and (unless jobs > 1) a route only gets a bound from Planner.lower_bound when they do not
+rule it out already. upper_bound is a value that the best mission is known not to exceed (e.g.
+the best value for a heavier payload), and routes with a lower bound above it are skipped.
+
+timeout limits the whole search to that many seconds (z3 also stops on a route when it runs out,
+as it does after the planner's own per-route timeout) and cancel (a Cancellation) stops it from
+another thread. Either way the best mission found so far is returned with "optimal" set to
+False, since routes that were not finished might have been better. With jobs > 1, cancelling
+terminates the pool, so routes that were still being solved are dropped.
+
+With jobs > 1 the routes are solved in a process pool (z3 contexts can not be shared across
+threads) and the bound is shared between the workers as it tightens. The workers' stats records,
+if the planner has stats, are added to the planner's stats in route order.
+"""
+def plan_routes(planner, paths, minimize, jobs=1, errors=None, prune=True, timeout=None, cancel=None, route_bounds=None, upper_bound=None):
+    with _budget(planner, timeout):
+        return _plan_routes(planner, paths, minimize, jobs, errors, prune, cancel, route_bounds, upper_bound)
+
+@contextmanager
+def _budget(planner, timeout):
+    deadline = planner.deadline
+    if timeout is not None:
+        planner.deadline = clock.time() + timeout
+    try:
+        yield
+    finally:
+        planner.deadline = deadline
+
+def _stopped(planner, cancel):
+    return (cancel is not None and cancel.cancelled()) or (planner.deadline is not None and clock.time() >= planner.deadline)
+
+def _plan_routes(planner, paths, minimize, jobs, errors, prune, cancel, route_bounds=None, upper_bound=None):
+    failure = None
+    for i, path in enumerate(paths):
+        try:
+            planner._check_route(path)
+        except Exception as e:
+            paths, failure = paths[:i], e
+            break
+
+    parallel = jobs > 1 and len(paths) > 1
+    # with known bounds, a route only gets the planner's bound if they do not rule it out already
+    lazy = prune and route_bounds is not None and any(route_bounds) and not parallel
+    if lazy:
+        bounds = list(route_bounds[:len(paths)])
+    else:
+        bounds = [planner.lower_bound(path, minimize) if prune else 0 for path in paths]
+        if prune and route_bounds is not None:
+            bounds = [max(bound, known) for bound, known in zip(bounds, route_bounds)]
+    order = sorted(range(len(paths)), key=lambda i: (bounds[i], i))
+    results = [(None, None)] * len(paths)
+    exact = [False] * len(paths) # whether a route was solved without being interrupted
+    skipped = 0
+    complete = True
+    if upper_bound is not None:
+        skipped = sum(1 for i in order if bounds[i] > upper_bound)
+        order = [i for i in order if bounds[i] <= upper_bound]
+    if parallel:
+        from multiprocessing import Pool, Value
+        bound = Value("i", -1)
+        tasks = [(bounds[i], [planner.graph.edge_ids[m] for m in paths[i]]) for i in order]
+        with Pool(min(jobs, len(paths)), initializer=_init_worker, initargs=(planner, minimize, bound)) as pool:
+            done = pool.imap(_plan_worker, tasks, chunksize=1)
+            for i in order:
+                result = _next(done, cancel)
+                if result is None:
+                    log.warning("Stopped before planning every route")
+                    pool.terminate()
+                    complete = False
+                    break
+                mission, minimize_value, records, interrupted = result
+                if mission == _SKIPPED:
+                    skipped += 1
+                    continue
+                if mission == _STOPPED or interrupted:
+                    complete = False
+                if mission == _STOPPED:
+                    continue
+                results[i] = (mission, minimize_value)
+                exact[i] = not interrupted
+                if planner.stats is not None:
+                    for record in records:
+                        planner.stats.add(record)
+    else:
+        best = None # (value, route index) of the winner so far
+        def ruled_out(i):
+            return bounds[i] == inf or (best is not None and (bounds[i], i) > best) or (upper_bound is not None and bounds[i] > upper_bound)
+        for i in order:
+            if ruled_out(i):
+                skipped += 1
+                continue
+            if _stopped(planner, cancel):
+                log.warning("Stopped before planning every route")
+                complete = False
+                break
+            if lazy:
+                bounds[i] = max(bounds[i], planner.lower_bound(paths[i], minimize))
+                if ruled_out(i):
+                    skipped += 1
+                    continue
+            # the best mission so far is also where z3 starts from on the maneuvers the route shares with it
+            hint = results[best[1]][0] if best and planner.hints else None
+            results[i] = _plan(planner, paths[i], minimize, best[0] if best else None, hint)
+            complete = complete and not planner.interrupted
+            exact[i] = not planner.interrupted
+            mission, _ = results[i]
+            if isinstance(mission, Exception):
+                break
+            if mission and (best is None or (mission[minimize], i) < best):
+                best = (mission[minimize], i)
+    if skipped:
+        log.info("Skipped {} of {} routes by their lower bounds".format(skipped, len(paths)))
+        if planner.stats is not None:
+            planner.stats.skipped += skipped
+
+    if route_bounds is not None:
+        _learn(route_bounds, bounds, results, exact, minimize)
+
+    best = None
+    for i, (mission, _) in enumerate(results):
+        if isinstance(mission, Exception):
+            failure = mission
+            break
+        if mission and (best is None or mission[minimize] < results[best][0][minimize]):
+            best = i
+    if failure is not None:
+        if errors is None:
+            log.error(failure)
+        else:
+            errors.append(failure)
+    if best is None:
+        return None
+
+    mission, minimize_value = results[best]
+    if minimize_value is not None and complete and not _stopped(planner, cancel):
+        log.debug("Re-planning {} without a bound".format(paths[best]))
+        replanned = planner.plan(paths[best], minimize=minimize)
+        # a re-plan that runs out of time may not reach the mission that was already found
+        if replanned is not None and not planner.interrupted:
+            return replanned
+        complete = False
+    if not complete:
+        mission = dict(mission, optimal=False)
+    return mission
+
+"""
+Update route_bounds from the results of plan_routes. A mission that was found with a bound is
+still the best one on its route, since the bound only rules out worse ones.
+"""
+def _learn(route_bounds, bounds, results, exact, minimize):
+    for i, (mission, minimize_value) in enumerate(results):
+        known = bounds[i]
+        if exact[i] and not isinstance(mission, Exception):
+            if mission:
+                known = mission[minimize]
+            elif minimize_value is not None:
+                known = max(known, minimize_value + 1)
+            else:
+                known = inf
+        route_bounds[i] = max(route_bounds[i], known)
+
+"""
+Plan the best mission on the routes for every payload in payloads, as plan_routes does for the
+planner's own load. Returns a dict of the missions (None where there is none) by payload.
+
+A mission that can carry a payload can also carry a lighter one, so the value of every route
+only gets worse as the payload grows and a payload that can not be flown rules out every heavier
+one. The lightest and heaviest payloads are planned first, and if the heaviest can not be flown,
+the heaviest one that can is found by bisection; the payloads above it are not planned. Every
+plan is seeded with the route values of the nearest lighter payload that was planned (as
+route_bounds), which puts the best routes first and skips the routes that can not win without
+working out their bounds, and the best value of the nearest heavier one (as upper_bound).
+
+errors, timeout and cancel are as in plan_routes, and only the first error is logged or added to
+errors. Stopping the search ends the sweep, and the payloads that were not planned are None.
+"""
+def sweep_routes(planner, paths, minimize, payloads, jobs=1, errors=None, prune=True, timeout=None, cancel=None):
+    with _budget(planner, timeout):
+        return _sweep_routes(planner, paths, minimize, payloads, jobs, errors, prune, cancel)
+
+def _sweep_routes(planner, paths, minimize, payloads, jobs, errors, prune, cancel):
+    payloads = sorted(set(payloads))
+    missions = {payload: None for payload in payloads}
+    learned = {} # the route bounds after planning each payload
+    failures = []
+    load = planner.load
+
+    def solve(k):
+        payload = payloads[k]
+        lighter = max((p for p in learned if p < payload), default=None)
+        heavier = min((p for p in learned if p > payload and missions[p] is not None), default=None)
+        route_bounds = list(learned[lighter]) if lighter is not None else [0] * len(paths)
+        upper_bound = missions[heavier][minimize] if heavier is not None else None
+        log.info("Planning for payload {}".format(payload))
+        planner.load = payload
+        missions[payload] = _plan_routes(planner, paths, minimize, jobs, failures, prune, cancel, route_bounds, upper_bound)
+        learned[payload] = route_bounds
+        if _stopped(planner, cancel):
+            raise _Stop()
+        return missions[payload] is not None
+
+    try:
+        last = len(payloads) - 1 # the heaviest payload that might be flown
+        if payloads and not solve(0):
+            last = -1
+        elif last > 0 and not solve(last):
+            lightest = 0
+            while last - lightest > 1:
+                middle = (lightest + last) // 2
+                if solve(middle):
+                    lightest = middle
+                else:
+                    last = middle
+            last = lightest
+        for k in range(1, last):
+            if payloads[k] not in learned:
+                solve(k)
+        log.info("Planned {} of {} payloads".format(len(learned), len(payloads)))
+    except _Stop:
+        log.warning("Stopped before planning every payload")
+    finally:
+        planner.load = load
+    if failures:
+        if errors is None:
+            log.error(failures[0])
+        else:
+            errors.append(failures[0])
+    return missions
+
+class _Stop(Exception):
+    pass
+
+OBJECTIVES = ("cost", "mass", "time")
+
+"""
+Return the missions over all routes that are Pareto-optimal in cost, mass and time, ordered by
+cost, then mass, then time.
+
+The routes are solved in order with Planner.pareto, each for the missions that are better than
+every mission found so far in at least one objective, so a later route only adds missions that
+are not dominated (or matched) by earlier ones, and removes the earlier missions that it
+dominates. With prune, a route is skipped without calling the solver when some mission found so
+far is no worse than the route's lower bounds in all three objectives.
+
+Errors, timeout and cancel work as in plan_routes; if the search is stopped, every mission has
+"optimal" set to False since the front may be incomplete. Routes are always solved in this
+process.
+"""
+def pareto_routes(planner, paths, errors=None, prune=True, timeout=None, cancel=None):
+    with _budget(planner, timeout):
+        return _pareto_routes(planner, paths, errors, prune, cancel)
+
+def _dominates(a, b):
+    return all(a[k] <= b[k] for k in OBJECTIVES) and a != b
+
+def _pareto_routes(planner, paths, errors, prune, cancel):
+    front = []
+    skipped = 0
+    complete = True
+    for path in paths:
+        if _stopped(planner, cancel):
+            log.warning("Stopped before planning every route")
+            complete = False
+            break
+        try:
+            if prune:
+                bounds = dict(zip(OBJECTIVES, (planner.lower_bound(path, k) for k in OBJECTIVES)))
+                if inf in bounds.values() or any(all(m[k] <= bounds[k] for k in OBJECTIVES) for m in front):
+                    skipped += 1
+                    continue
+            log.debug("Planning for {}".format(path))
+            missions = planner.pareto(path, [tuple(m[k] for k in OBJECTIVES) for m in front])
+        except Exception as e:
+            if errors is None:
+                log.error(e)
+            else:
+                errors.append(e)
+            break
+        log.info("Found {} Pareto-optimal missions using {}".format(len(missions), path))
+        complete = complete and not planner.interrupted
+        front = [m for m in front if not any(_dominates(n, m) for n in missions)] + missions
+    if skipped:
+        log.info("Skipped {} of {} routes by their lower bounds".format(skipped, len(paths)))
+        if planner.stats is not None:
+            planner.stats.skipped += skipped
+
+    front.sort(key=lambda m: tuple(m[k] for k in OBJECTIVES))
+    if not complete:
+        front = [dict(m, optimal=False) for m in front]
+    return front
+
+def _plan(planner, path, minimize, minimize_value, hint=None):
+    log.debug("Planning for {}".format(path))
+    try:
+        mission = planner.plan(path, minimize=minimize, minimize_value=minimize_value, hint=hint)
+    except Exception as e:
+        return e, minimize_value
+    if mission:
+        log.info("Found solution using {} with value {}".format(path, mission[minimize]))
+    else:
+        log.info("Unable to find a solution using {}".format(path))
+    return mission, minimize_value
+
+"""
+Wait for the next result of a pool, or return None if the search is cancelled first.
+"""
+def _next(results, cancel):
+    from multiprocessing import TimeoutError
+    while True:
+        try:
+            return results.next(timeout=0.1)
+        except TimeoutError:
+            if cancel is not None and cancel.cancelled():
+                return None
+
+_worker = None
+
+def _init_worker(planner, minimize, bound):
+    global _worker
+    # cancelling is up to the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # a forked worker starts with the parent's records, which are not its own to send back
+    if planner.stats is not None:
+        planner.stats.routes = []
+    _worker = (planner, minimize, bound)
+
+_SKIPPED = "skipped"
+_STOPPED = "stopped"
+
+def _plan_worker(task):
+    lower_bound, edges = task
+    planner, minimize, bound = _worker
+    with bound.get_lock():
+        minimize_value = bound.value if bound.value >= 0 else None
+    if lower_bound == inf or (minimize_value is not None and lower_bound > minimize_value):
+        return _SKIPPED, None, [], False
+    if _stopped(planner, None):
+        return _STOPPED, None, [], True
+    mission, minimize_value = _plan(planner, planner.graph.route(edges), minimize, minimize_value)
+    if mission and not isinstance(mission, Exception):
+        with bound.get_lock():
+            if bound.value < 0 or mission[minimize] < bound.value:
+                bound.value = mission[minimize]
+    records = []
+    if planner.stats is not None:
+        records, planner.stats.routes = planner.stats.routes, []
+    return mission, minimize_value, records, planner.interrupted
+
+"""
+A flag for stopping a search from another thread. cancel() also interrupts z3 if it is solving
+in this process, so the route being planned stops with the best solution found so far.
+"""
+class Cancellation():
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+        z3 = sys.modules.get("z3")
+        if z3 is not None:
+            z3.main_ctx().interrupt()
+
+    def cancelled(self):
+        return self._event.is_set()
+
+"""
+Call f() in a thread and return its result. If the calling thread gets a KeyboardInterrupt (e.g.
+Ctrl-C) while it waits, cancel is cancelled and f() is still waited for, so that it can return
+what it found so far.
+"""
+def run_cancellable(f, cancel):
+    outcome = {}
+    done = threading.Event()
+    def target():
+        try:
+            outcome["result"] = f()
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+    threading.Thread(target=target, daemon=True).start()
+    while not done.is_set():
+        try:
+            done.wait(0.1)
+        except KeyboardInterrupt:
+            log.warning("Cancelling")
+            cancel.cancel()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+"""
+The routes to try between two locations (given by code), kept between queries so that each pair
+is only searched once per process and map.
+"""
+@lru_cache(maxsize=4096)
+def best_paths(orig, dest, routes="optimal", single_stage=False, aerobraking=False, graph=DEFAULT_GRAPH):
+    paths = find_best_paths(graph.codes[orig], graph.codes[dest], path_filter=routes, single_stage=single_stage,
+                            aerobraking=aerobraking, graph=graph)
+    return tuple(tuple(path) for path in paths)
+
+"""
+The routes from orig to each of destinations (location codes), in the same order, found together
+and kept like those of best_paths().
+"""
+@lru_cache(maxsize=256)
+def campaign_paths(orig, destinations, routes="optimal", single_stage=False, aerobraking=False, graph=DEFAULT_GRAPH):
+    dsts = [graph.codes[dest] for dest in destinations]
+    paths = find_campaign_paths(graph.codes[orig], dsts, path_filter=routes, single_stage=single_stage,
+                                aerobraking=aerobraking, graph=graph)
+    return tuple(tuple(tuple(path) for path in paths[dst]) for dst in dsts)
+
+"""
+A long-lived planning context for answering many queries in one process.
+
+Route searches are cached by best_paths() and planners are kept (up to max_planners, least
+recently used first out) for every distinct set of planner settings, so queries that share
+settings also share the z3 solver of an IncrementalPlanner.
+"""
+class Session():
+    def __init__(self, jobs=1, cache=None, max_planners=32):
+        self.jobs = jobs
+        self.cache = cache
+        self.max_planners = max_planners
+        self._planners = OrderedDict()
+
+    def planner(self, timeout=None, **options):
+        planner = IncrementalPlanner(**options)
+        key = json.dumps(planner.params(), sort_keys=True)
+        if key in self._planners:
+            self._planners.move_to_end(key)
+            self._planners[key].timeout = timeout
+            return self._planners[key]
+        planner.cache = self.cache
+        planner.timeout = timeout
+        self._planners[key] = planner
+        while len(self._planners) > self.max_planners:
+            self._planners.popitem(last=False)
+        return planner
+
+    """
+    Plan the best mission from orig to dest (location codes). options are passed on to the
+    Planner, e.g. graph for a map other than the default one. Returns the mission (None if there is none) and the list of errors that stopped the
+    search. If stats is given, it collects the route search and planning statistics of this query.
+    timeout, route_timeout and cancel limit the search as in plan_routes and Planner. With
+    minimize="pareto", the mission is the list of missions from pareto_routes.
+    """
+    def solve(self, orig, dest, payload=1, minimize="cost", routes="optimal", single_stage=False, stats=None,
+              timeout=None, route_timeout=None, cancel=None, **options):
+        if orig == dest:
+            raise Exception("Origin and destination may not be the same.")
+        planner = self.planner(load=payload, timeout=route_timeout, **options)
+        for code in (orig, dest):
+            if code not in planner.graph.codes:
+                raise Exception("Unknown location {}.".format(code))
+        with stats.timer("paths") if stats is not None else nullcontext():
+            paths = best_paths(orig, dest, routes, single_stage, planner.aerobraking, planner.graph)
+        log.info("Found {} paths using '{}' strategy".format(len(paths), routes))
+        errors = []
+        planner.stats = stats
+        try:
+            if minimize == "pareto":
+                mission = pareto_routes(planner, [list(path) for path in paths], errors=errors, timeout=timeout, cancel=cancel)
+            else:
+                mission = plan_routes(planner, [list(path) for path in paths], minimize, jobs=self.jobs, errors=errors,
+                                      timeout=timeout, cancel=cancel)
+        finally:
+            planner.stats = None
+        return mission, errors
+
+    """
+    Plan the best mission from orig to every one of destinations (location codes) for every one
+    of payloads, e.g. for a set of missions that are flown from the same place. Returns a dict of
+    the missions (as in solve()) by (destination, payload) and the list of errors that stopped a
+    search. The other arguments are as in solve(), with timeout limiting the whole campaign.
+
+    The routes to every destination are searched for together, and one PrefixPlanner plans all of
+    them, so the constraints of the maneuvers that the routes start with (e.g. E -> Eso -> Eo)
+    are shared between destinations and payloads, while routes that end the same way share the
+    allocator's search as usual.
+    """
+    def campaign(self, orig, destinations, payloads=(1,), minimize="cost", routes="optimal", single_stage=False, stats=None,
+                 timeout=None, route_timeout=None, cancel=None, **options):
+        destinations = tuple(destinations)
+        planner = PrefixPlanner(load=payloads[0], cache=self.cache, stats=stats, timeout=route_timeout, **options)
+        for code in (orig,) + destinations:
+            if code not in planner.graph.codes:
+                raise Exception("Unknown location {}.".format(code))
+        if orig in destinations:
+            raise Exception("Origin and destination may not be the same.")
+        with stats.timer("paths") if stats is not None else nullcontext():
+            paths = campaign_paths(orig, destinations, routes, single_stage, planner.aerobraking, planner.graph)
+        missions = {}
+        errors = []
+        with _budget(planner, timeout):
+            for payload in payloads:
+                planner.load = payload
+                for dest, found in zip(destinations, paths):
+                    if _stopped(planner, cancel):
+                        log.warning("Stopped before planning {} with payload {}".format(dest, payload))
+                        missions[(dest, payload)] = None
+                        continue
+                    log.info("Planning {} to {} with payload {} over {} paths".format(orig, dest, payload, len(found)))
+                    if minimize == "pareto":
+                        mission = pareto_routes(planner, [list(path) for path in found], errors=errors, cancel=cancel)
+                    else:
+                        mission = plan_routes(planner, [list(path) for path in found], minimize, jobs=self.jobs, errors=errors, cancel=cancel)
+                    missions[(dest, payload)] = mission
+        return missions, errors
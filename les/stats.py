@@ -0,0 +1,109 @@
+from contextlib import contextmanager
+import time
+
+"""
+Optional instrumentation of a Planner. Assign an instance to Planner.stats (or pass it as stats=)
+and every call to plan() adds a record with the route, the engine that solved it, its wall time
+and the time spent in each phase (encode, check and decode for z3), the size of the z3 model
+(constraints and variables, and the variables before and after the presolve as presolve), z3's
+own statistics and whether the route was solved or pruned.
+Phases outside of plan() (e.g. the route search) are timed with timer() and kept in phases.
+
+A route counts as pruned when it was planned with a minimize_value bound and had no solution:
+the bound (or the route itself) ruled it out without a mission being decoded. Routes that are
+skipped before planning are counted in skipped.
+
+callback, if given, is called with each record as soon as the route is done. Everything is plain
+data, so as_dict() can be written out as JSON.
+"""
+class PlannerStats:
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.routes = []
+        self.phases = {}
+        self.skipped = 0
+        self._current = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["callback"] = None # callbacks stay in the process that made them
+        return state
+
+    def begin(self, route, minimize=None, minimize_value=None):
+        self._current = {"route": [m.src.code for m in route[:1]] + [m.dst.code for m in route],
+                         "minimize": minimize, "bound": minimize_value, "engine": None, "phases": {}}
+        self._start = time.perf_counter()
+
+    def end(self, mission, error=None):
+        record = self._current
+        if record is None:
+            return
+        self._current = None
+        record["wall"] = time.perf_counter() - self._start
+        record["solved"] = mission is not None
+        record["pruned"] = mission is None and error is None and record["bound"] is not None
+        if error is not None:
+            record["error"] = str(error)
+        self.add(record)
+
+    """
+    Add a finished record, e.g. one made in a worker process.
+    """
+    def add(self, record):
+        self.routes.append(record)
+        if self.callback:
+            self.callback(record)
+
+    def set(self, **values):
+        if self._current is not None:
+            self._current.update(values)
+
+    """
+    Time a block, in the current route's phases if a route is being planned and in phases
+    otherwise. Repeated phases add up.
+    """
+    @contextmanager
+    def timer(self, name):
+        phases = self._current["phases"] if self._current is not None else self.phases
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
+    """
+    Record the size of a z3 model and z3's statistics after solving it.
+    """
+    def solver(self, solver, result):
+        statistics = solver.statistics()
+        self.set(result=str(result), constraints=len(solver.assertions()), variables=_count_variables(solver),
+                 z3={key: statistics.get_key_value(key) for key in statistics.keys()})
+
+    def summary(self):
+        return {
+            "routes": len(self.routes),
+            "solved": sum(1 for r in self.routes if r["solved"]),
+            "pruned": sum(1 for r in self.routes if r["pruned"]),
+            "skipped": self.skipped,
+            "wall": sum(r["wall"] for r in self.routes),
+            "phases": dict(self.phases),
+        }
+
+    def as_dict(self):
+        return {"summary": self.summary(), "routes": list(self.routes)}
+
+def _count_variables(solver):
+    from z3 import is_const, Z3_OP_UNINTERPRETED
+    seen = set()
+    names = set()
+    todo = list(solver.assertions()) + list(solver.objectives())
+    while todo:
+        e = todo.pop()
+        if e.get_id() in seen:
+            continue
+        seen.add(e.get_id())
+        if is_const(e) and e.decl().kind() == Z3_OP_UNINTERPRETED:
+            names.add(e.decl().name())
+        else:
+            todo.extend(e.children())
+    return len(names)
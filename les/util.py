@@ -1,3 +1,4 @@
+DEFAULT_COMPONENT_MAX = 8
 JUN_COST = 1
 ATL_COST = 5
 SYZ_COST = 8
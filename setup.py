@@ -20,6 +20,7 @@ setup(name="les",
       license="",
       packages=find_packages(exclude=["tests"]),
       include_package_data=True,
+      package_data={"les": ["maps/*.json"]},
       zip_safe=False,
       install_requires=install_requires,
       entry_points={
@@ -0,0 +1,33 @@
+import pytest
+from les import allocator
+from les.les import Planner
+from les.solve import best_paths
+from les.util import ION_WEIGHT
+
+QUERIES = [
+    ("E", "Mo", {}),
+    ("E", "Mo", {"aerobraking": True}),
+    ("E", "Mfb", {"free_ions": 1}),
+    ("E", "Mfb", {"free_ions": 1, "rendezvous": False}),
+    ("E", "Mo", {"ion": (0, 0), "rendezvous": False}),
+    ("E", "Mo", {"year": 1960}),
+    ("E", "Sfb", {"year": 1960}),
+]
+
+@pytest.mark.parametrize("minimize", ["mass", "cost", "time"])
+@pytest.mark.parametrize("orig,dest,options", QUERIES)
+def test_check(orig, dest, options, minimize):
+    path = list(best_paths(orig, dest)[0])
+    planner = Planner(**dict({"load": 2}, **options), engine="check")
+    assert allocator.applies(planner, list(reversed(path)))
+    assert planner.plan(path, minimize=minimize) is not None
+
+"""
+With free ions the mass objective does not count the ions, so one more (free) ion is as good as
+one less: the engines agree on the objective but need not pick the same number of ions.
+"""
+def test_free_ion_tie():
+    path = list(best_paths("E", "Mfb")[0])
+    missions = [Planner(load=2, free_ions=2, engine=engine).plan(path, minimize="mass")
+                for engine in ("dp", "z3", "check")]
+    assert len({(m["cost"], m["time"], m["mass"] - ION_WEIGHT*m["components"].get("ion", 0)) for m in missions}) == 1
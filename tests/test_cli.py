@@ -0,0 +1,23 @@
+import json
+from click.testing import CliRunner
+from les.scripts.cli import cli
+
+QUERIES = "".join(json.dumps(q) + "\n" for q in [
+    {"origin": "E", "destination": "Mo"},
+    {"origin": "E", "destination": "Lo", "payload": 2},
+])
+
+"""
+Every batch query is planned in a thread of its own, so the cache has to be usable from each.
+"""
+def test_batch_cache(tmp_path):
+    cache = str(tmp_path / "missions.db")
+    runs = []
+    for _ in range(2): # planned, then found in the cache
+        result = CliRunner().invoke(cli, ["batch", "--cache", cache], input=QUERIES)
+        assert result.exit_code == 0, result.output
+        runs.append([json.loads(line) for line in result.output.splitlines()])
+    for results in runs:
+        assert [r["id"] for r in results] == [1, 2]
+        assert all("error" not in r and r["mission"] for r in results)
+    assert runs[0] == runs[1]
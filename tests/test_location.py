@@ -0,0 +1,82 @@
+import json
+import sys
+import pytest
+from les import find_best_paths
+from les.location import DEFAULT_GRAPH, parse_map, load_map, create_location, connect_locations
+from les.location import JUPITER_SLINGSHOT, SATURN_SLINGSHOT, URANUS_SLINGSHOT, NEPTUNE_SLINGSHOT
+
+# the key of the graph that location.py built in code before the map was a data file
+CODED_KEY = "f42f12e10f85a05f0c2060e1f3147b03221063f27eb026cd7948766e3035027e"
+
+def _map(**changes):
+    data = DEFAULT_GRAPH.to_map()
+    data.update(changes)
+    return data
+
+def test_default_map():
+    data = _map()
+    assert (data.pop("name"), data.pop("single_stage")) == ("Leaving Earth", ["E", "Eso", "Eo"])
+    assert parse_map(data).key == CODED_KEY
+    assert JUPITER_SLINGSHOT == tuple(range(1956, 1986, 2))
+    assert SATURN_SLINGSHOT == tuple(range(1957, 1986, 3))
+    assert URANUS_SLINGSHOT == tuple(range(1957, 1986, 5))
+    assert NEPTUNE_SLINGSHOT == tuple(range(1958, 1986, 6))
+
+def test_same_map():
+    assert parse_map(_map()) is DEFAULT_GRAPH
+    other = parse_map(_map(name="Another map"))
+    assert other is not DEFAULT_GRAPH and other.name == "Another map"
+    assert parse_map(_map(name="Another map")) is other
+
+def test_load_map(tmp_path):
+    path = tmp_path / "map.json"
+    path.write_text(json.dumps(_map()))
+    assert load_map(str(path)) is DEFAULT_GRAPH
+    path.write_text(json.dumps(_map(name="Changed")))
+    assert load_map(str(path)).name == "Changed"
+
+@pytest.mark.skipif(sys.version_info < (3, 11), reason="TOML maps need tomllib")
+def test_load_toml_map(tmp_path):
+    path = tmp_path / "map.toml"
+    path.write_text('name = "Short"\n'
+                    'locations = [{code = "A", name = "Alpha"}, {code = "B", name = "Beta"}]\n'
+                    'maneuvers = [{origin = "A", destination = "B", difficulty = 3, time = 1}]\n')
+    graph = load_map(str(path))
+    assert graph.name == "Short"
+    assert repr(graph.codes["A"].to(graph.codes["B"])) == "A-(3/1)->B"
+
+def _maneuver(**changes):
+    maneuver = {"origin": "E", "destination": "Eso", "difficulty": 3}
+    maneuver.update(changes)
+    return {k: v for k, v in maneuver.items() if v is not None}
+
+BAD_MAPS = [
+    ([], "A map must be an object."),
+    (_map(planets=[]), "Unknown map fields planets."),
+    (_map(locations=[{"name": "Earth"}]), "A location is missing its code."),
+    (_map(locations=[{"code": "E"}]), "A location is missing its name."),
+    (_map(locations=[{"code": "E", "name": "Earth"}, {"code": "E", "name": "Earth again"}]), "Location E is defined twice."),
+    (_map(locations=[{"code": "E", "name": "Earth"}, {"code": "F", "name": "Earth"}]), "Location name Earth is used twice."),
+    (_map(maneuvers=[_maneuver(length=2)]), "Unknown maneuver fields length."),
+    (_map(maneuvers=[_maneuver(difficulty=None)]), "A maneuver is missing its difficulty."),
+    (_map(maneuvers=[_maneuver(destination="X")]), "Unknown location X."),
+    (_map(maneuvers=[_maneuver(slingshot="Pluto")]), "Unknown slingshot Pluto."),
+]
+
+@pytest.mark.parametrize("data,message", BAD_MAPS)
+def test_bad_map(data, message):
+    with pytest.raises(Exception) as e:
+        parse_map(data)
+    assert str(e.value) == message
+
+def test_removed_helpers():
+    with pytest.raises(Exception, match="create_location has been removed"):
+        create_location("Planet X", "X")
+    with pytest.raises(Exception, match="connect_locations has been removed"):
+        connect_locations("Nfb", "X", 4, time=5)
+    # what to do instead
+    data = DEFAULT_GRAPH.to_map()
+    data["locations"].append({"code": "X", "name": "Planet X"})
+    data["maneuvers"].append({"origin": "Nfb", "destination": "X", "difficulty": 4, "time": 5})
+    graph = parse_map(data)
+    assert [repr(m) for m in find_best_paths(graph.codes["E"], graph.codes["X"], graph=graph)[0]][-1] == "Nfb-(4/5)->X"
@@ -0,0 +1,111 @@
+import io
+import json
+import struct
+import pytest
+from les.location import DEFAULT_GRAPH, parse_map
+from les.mission import Mission, MissionWriter, pack, unpack, unpack_from, read_missions
+
+def _name(code):
+    return DEFAULT_GRAPH.codes[code].name
+
+def _stage(origin, destination, difficulty, components, thrust, **options):
+    stage = {"origin": _name(origin), "destination": _name(destination), "difficulty": difficulty,
+             "components": components, "aerobraking": options.pop("aerobraking", False)}
+    stage.update(options)
+    stage["thrust"] = thrust
+    stage["slingshot"] = stage.pop("slingshot", False)
+    return stage
+
+MISSIONS = {
+    "plain": {
+        "components": {"soyuz": 2, "ion": 1}, "payload": 1, "mass": 20, "cost": 26, "time": 3,
+        "plan": [_stage("E", "Eso", 3, {"soyuz": 1}, 80),
+                 _stage("Eso", "Eo", 5, {"soyuz": 1}, 80),
+                 _stage("Eo", "Mo", 5, {"ion": 1}, 15, time=3)],
+    },
+    "years": {
+        "start": 1960, "end": 1967,
+        "components": {"proton": 1, "saturn": 1, "ion": 2}, "payload": 3, "mass": 28, "cost": 48, "time": 7,
+        "plan": [_stage("E", "Eso", 3, {"saturn": 1}, 200, year=1960),
+                 _stage("Eso", "Eo", 5, {"proton": 1}, 70, year=1960),
+                 _stage("Eo", "opt", 3, {"ion": 2}, 30, time=1, year=1960),
+                 _stage("opt", "Jfb", 4, {"ion": 2}, 60, time=2, year=1961,
+                        rendezvous=[{"detach": ["ion", 2]}]),
+                 _stage("Jfb", "Sfb", 0, {}, 0, time=2, year=1963, slingshot=True),
+                 _stage("Sfb", "So", 3, {}, 0, time=2, year=1965, aerobraking=True)],
+        "optimal": False,
+    },
+    "optimal": {
+        "components": {"atlas": 1}, "payload": 2, "mass": 6, "cost": 5, "time": 0,
+        "plan": [_stage("Lo", "L", 2, {"atlas": 1}, 27)],
+        "optimal": True,
+    },
+    # beyond the field widths before the encoding was widened
+    "large": {
+        "components": {"juno": 300, "ion": 300}, "payload": 70000, "mass": 70900, "cost": 103000, "time": 300,
+        "plan": [_stage("E", "Eso", 3, {"juno": 300}, 100000),
+                 _stage("Eso", "Eo", 5, {"ion": 300}, 1500000, time=300)],
+    },
+}
+
+@pytest.mark.parametrize("name", sorted(MISSIONS))
+def test_round_trip(name):
+    mission = MISSIONS[name]
+    data = pack(mission)
+    decoded = unpack(data).to_dict()
+    assert decoded == mission
+    assert json.dumps(decoded) == json.dumps(mission) # with the same key order
+    assert pack(Mission.from_dict(mission)) == data
+
+def test_unpack_from_offsets():
+    data = b"".join(pack(mission) for mission in MISSIONS.values())
+    offset = 0
+    for mission in MISSIONS.values():
+        decoded, offset = unpack_from(data, offset)
+        assert decoded.to_dict() == mission
+    assert offset == len(data)
+
+def test_too_large():
+    mission = dict(MISSIONS["plain"], payload=2**32)
+    with pytest.raises(struct.error):
+        pack(mission)
+
+"""
+A file that returns at most size bytes per read, so that records are split between reads.
+"""
+class _Trickle(io.BytesIO):
+    def __init__(self, data, size=7):
+        super().__init__(data)
+        self.size = size
+
+    def read(self, n=-1):
+        return super().read(self.size if n < 0 else min(n, self.size))
+
+def _written(missions, graph=DEFAULT_GRAPH):
+    f = io.BytesIO()
+    writer = MissionWriter(f, graph)
+    for mission in missions:
+        writer.write(mission)
+    return f.getvalue()
+
+def test_stream():
+    missions = list(MISSIONS.values()) * 3
+    data = _written(missions)
+    assert [m.to_dict() for m in read_missions(io.BytesIO(data))] == missions
+    assert [m.to_dict() for m in read_missions(_Trickle(data))] == missions
+    assert list(read_missions(io.BytesIO(_written([])))) == []
+
+def test_truncated():
+    data = _written(list(MISSIONS.values()))
+    for cut in (1, 5, len(pack(MISSIONS["large"])) - 1):
+        missions = read_missions(_Trickle(data[:-cut]))
+        for _ in range(len(MISSIONS) - 1):
+            next(missions)
+        with pytest.raises(Exception, match="Truncated mission file."):
+            next(missions)
+
+def test_foreign_header():
+    other = parse_map(dict(DEFAULT_GRAPH.to_map(), name="Another map"))
+    for data in (_written(MISSIONS.values(), other), b"", b"LESM1" + DEFAULT_GRAPH.key.encode(), b"not a mission file"):
+        with pytest.raises(Exception, match="Not a mission file for this location graph."):
+            next(read_missions(io.BytesIO(data)))